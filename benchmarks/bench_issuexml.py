@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (C) 2006-2009 Citrix Systems Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation; version 2.1 only. with the special
+# exception on linking described in file LICENSE.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+"""Compare the streaming JiraIssueXml parser with a minidom parse of the
+same synthetic issue XML, in wall time and peak resident memory.
+
+Usage: bench_issuexml.py [--comments N] [--comment-size BYTES] [--runs N]
+"""
+
+import os, sys, time, resource
+import argparse
+import StringIO
+import xml.dom.minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import jira
+
+def issueXml(comments, commentSize, links=20, subtasks=10):
+    """Build an issue-xml view with the given number of comments and links"""
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<rss version="0.92"><channel><title>JIRA</title><item>'
+           '<title>[CA-1] Synthetic issue</title>'
+           '<description>%s</description>'
+           '<key id="10001">CA-1</key><summary>Synthetic issue</summary>'
+           '<parent id="10000">CA-0</parent><comments>'
+           % ("Long description. " * 500)]
+    body = ("x" * (commentSize - 1)) + "\n"
+    for i in range(comments):
+        out.append('<comment id="%d" author="user%d" created="now">%s</comment>'
+                   % (i, i % 50, body))
+    out.append('</comments><issuelinks><issuelinktype id="10000"><name>Blocks</name>'
+               '<outwardlinks description="blocks">')
+    for i in range(links):
+        out.append('<issuelink><issuekey id="%d">CA-%d</issuekey></issuelink>'
+                   % (20000 + i, 2 + i))
+    out.append('</outwardlinks></issuelinktype></issuelinks><subtasks>')
+    for i in range(subtasks):
+        out.append('<subtask id="%d">CA-%d</subtask>' % (30000 + i, 1000 + i))
+    out.append('</subtasks><customfields>')
+    for i in range(200):
+        out.append('<customfield id="customfield_%d"><customfieldname>F%d'
+                   '</customfieldname><customfieldvalues><customfieldvalue>v'
+                   '</customfieldvalue></customfieldvalues></customfield>' % (i, i))
+    out.append('</customfields></item></channel></rss>')
+    return "".join(out)
+
+def parseMinidom(data):
+    """The DOM based extraction JiraIssue used before JiraIssueXml"""
+    dom = xml.dom.minidom.parseString(data)
+    dom.getElementsByTagName("key")[0].getAttribute("id")
+    links = []
+    for ilt in dom.getElementsByTagName("issuelinktype"):
+        for cn in ilt.childNodes:
+            if cn.nodeName == "outwardlinks" or cn.nodeName == "inwardlinks":
+                desc = cn.attributes['description'].value
+                for cnn in cn.childNodes:
+                    if cnn.nodeName == "issuelink":
+                        for cnnn in cnn.childNodes:
+                            if cnnn.nodeName == "issuekey":
+                                links.append((desc, cnnn.childNodes[0].data))
+    parents = [ p.childNodes[0].data for p in dom.getElementsByTagName("parent") ]
+    subtasks = []
+    for st in dom.getElementsByTagName("subtasks"):
+        for cn in st.childNodes:
+            if cn.nodeName == "subtask":
+                subtasks.append(cn.childNodes[0].data)
+    return links, parents, subtasks
+
+def parseStreaming(data):
+    return jira.JiraIssueXml(StringIO.StringIO(data))
+
+def timeParser(parse, data, runs):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        parse(data)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def peakMemory(parse, data):
+    """Peak RSS in KB of a child process running parse once"""
+    pid = os.fork()
+    if pid == 0:
+        if parse:
+            parse(data)
+        os._exit(0)
+    return os.wait4(pid, 0)[2].ru_maxrss
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comments", type=int, default=500)
+    parser.add_argument("--comment-size", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    data = issueXml(args.comments, args.comment_size)
+    print "issue XML: %d comments, %.1f MB" % (args.comments,
+                                               len(data) / 1048576.0)
+    parsers = (("minidom", parseMinidom), ("streaming", parseStreaming))
+    # Measure memory before timing anything so the children start from the
+    # same heap as the baseline child
+    base = peakMemory(None, data)
+    peaks = [ peakMemory(parse, data) - base for name, parse in parsers ]
+    for (name, parse), peak in zip(parsers, peaks):
+        elapsed = timeParser(parse, data, args.runs)
+        print "%-10s %8.1f ms  %8.1f MB extra peak RSS" % (name, elapsed * 1000,
+                                                          peak / 1024.0)
+
+if __name__ == "__main__":
+    main()
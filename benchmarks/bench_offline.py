@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# Copyright (C) 2006-2009 Citrix Systems Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation; version 2.1 only. with the special
+# exception on linking described in file LICENSE.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+"""Time common jira.py workloads against a local StubJira server, reporting
+the wall time and the number of requests the server received for each.
+
+The round trip counts do not depend on the machine, so comparing them
+between versions catches regressions that timings on a fast local server
+would hide.
+
+Usage: bench_offline.py [--issues N] [--latency SECONDS] [--workers N]
+                        [--attachments N] [--attachment-size BYTES]
+                        [--roots N] [--only NAME] [--verbose]
+"""
+
+import os, sys, time, shutil, tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import jira
+import stubjira
+
+FILTER_ID = "10000"
+
+def connect(stub, **kw):
+    return jira.Jira(stub.url, "user", "password", **kw)
+
+def benchStartup(stub, args):
+    yield "Jira() startup", lambda: connect(stub)
+
+    cacheDir = tempfile.mkdtemp()
+    try:
+        yield "Jira() startup, cold disk cache", \
+              lambda: connect(stub, cacheDir=cacheDir)
+        yield "Jira() startup, warm disk cache", \
+              lambda: connect(stub, cacheDir=cacheDir)
+    finally:
+        shutil.rmtree(cacheDir)
+
+def benchFilter(stub, args):
+    j = connect(stub)
+    yield "filter, %d issues" % args.issues, \
+          lambda: j.getIssuesFromFilter(FILTER_ID)
+    yield "filter, %d lazy issues" % args.issues, \
+          lambda: j.getIssuesFromFilter(FILTER_ID, lazy=True)
+    yield "filter, %d snapshots" % args.issues, \
+          lambda: j.getIssuesFromFilter(FILTER_ID, snapshot=True)
+    yield "filter, paged by 50", \
+          lambda: list(j.iterIssuesFromFilter(FILTER_ID, pageSize=50))
+
+def benchLinks(stub, args):
+    keys = [ "CA-%d" % n for n in range(1, args.roots + 1) ]
+    j = connect(stub)
+
+    def serial():
+        for key in keys:
+            issue = j.getIssue(key)
+            issue.getLinks()
+            issue.getChildren()
+    yield "getLinks/getChildren, %d issues" % len(keys), serial
+
+    def lazy():
+        for key in keys:
+            issue = j.getIssue(key, lazy=True)
+            issue.getLinks()
+            issue.getChildren()
+    yield "getLinks/getChildren, %d lazy issues" % len(keys), lazy
+
+    yield "link graph from CA-1, depth 3", \
+          lambda: j.buildLinkGraph(["CA-1"], depth=3,
+                                   maxWorkers=args.workers)
+
+def benchAttachments(stub, args):
+    j = connect(stub)
+    workdir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(args.attachments):
+            path = os.path.join(workdir, "file-%d.bin" % i)
+            f = file(path, "wb")
+            f.write(os.urandom(args.attachment_size))
+            f.close()
+            paths.append(path)
+
+        issue = j.getIssue("CA-1", lazy=True)
+        yield "attach %d files one by one" % len(paths), \
+              lambda: [ issue.attachFile(path) for path in paths ]
+        yield "attach %d files in one call" % len(paths), \
+              lambda: issue.attachFiles(paths)
+
+        target = os.path.join(workdir, "copy")
+        os.mkdir(target)
+        # Each file is attached twice, only the last copy is downloaded
+        yield "copy %d attachments, 1 worker" % len(paths), \
+              lambda: issue.copyAttachmentsTo(target, maxWorkers=1)
+        yield "copy %d attachments, %d workers" % (len(paths), args.workers), \
+              lambda: issue.copyAttachmentsTo(target, maxWorkers=args.workers)
+        yield "copy attachments, unchanged", \
+              lambda: issue.copyAttachmentsTo(target, skipUnchanged=True)
+    finally:
+        shutil.rmtree(workdir)
+
+def benchBulk(stub, args):
+    keys = [ "CA-%d" % n for n in range(1, args.issues + 1) ]
+    j = connect(stub)
+
+    def serial():
+        for key in keys:
+            issue = j.getIssue(key)
+            issue.setSummary("Updated %s" % key)
+            issue.setCustomField("Field 1", "updated")
+            issue.addComment("Bulk edit")
+    yield "update %d issues one by one" % len(keys), serial
+
+    changes = [ (key, [("setSummary", "Bulk %s" % key),
+                       ("setCustomField", "Field 1", "bulk"),
+                       ("addComment", "Bulk edit")]) for key in keys ]
+    def bulk():
+        for result in j.bulkUpdate(changes, maxWorkers=args.workers):
+            if not result.ok():
+                raise result.error
+    yield "bulkUpdate %d issues" % len(keys), bulk
+
+def benchCreate(stub, args):
+    j = connect(stub)
+    specs = [ {"project": "CA", "summary": "Failure %d" % n, "type": "Bug",
+               "priority": "Major", "description": "Found by run %d" % n,
+               "customFields": [("Field 1", ["run %d" % n]),
+                                ("Field 2", ["host%d" % (n % 8)])]}
+              for n in range(args.issues) ]
+
+    def serial():
+        for spec in specs:
+            j.createIssue(**spec)
+    yield "create %d issues one by one" % len(specs), serial
+
+    def batch():
+        for result in j.createIssues(specs, maxWorkers=args.workers):
+            if not result.ok():
+                raise result.error
+    yield "createIssues %d issues" % len(specs), batch
+
+BENCHMARKS = (("startup", benchStartup), ("filter", benchFilter),
+              ("links", benchLinks), ("attachments", benchAttachments),
+              ("bulk", benchBulk), ("create", benchCreate))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--issues", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--attachments", type=int, default=4)
+    parser.add_argument("--attachment-size", type=int, default=1048576)
+    parser.add_argument("--roots", type=int, default=20)
+    parser.add_argument("--only", choices=[ name for name, b in BENCHMARKS ])
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    stub = stubjira.StubJira(issues=args.issues, latency=args.latency)
+    stub.start()
+    print "stub JIRA: %d issues, %.1f ms latency" % (args.issues,
+                                                     args.latency * 1000)
+    print "%-45s %10s %12s" % ("benchmark", "wall ms", "round trips")
+    try:
+        for name, bench in BENCHMARKS:
+            if args.only and args.only != name:
+                continue
+            for label, run in bench(stub, args):
+                stub.resetCounts()
+                start = time.time()
+                run()
+                elapsed = time.time() - start
+                print "%-45s %10.1f %12d" % (label, elapsed * 1000,
+                                             stub.getRoundTrips())
+                if args.verbose:
+                    counts = stub.getCounts().items()
+                    counts.sort(key=lambda item: -item[1])
+                    for operation, count in counts:
+                        print "    %-41s %23d" % (operation, count)
+    finally:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Copyright (C) 2006-2009 Citrix Systems Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation; version 2.1 only. with the special
+# exception on linking described in file LICENSE.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+"""Compare the memory retained by JiraIssue and JiraIssueSnapshot objects
+built from the same synthetic RemoteIssues, as returned by SOAPpy.
+
+Usage: bench_snapshot.py [--issues N]
+"""
+
+import os, sys, time, gc
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import jira
+from SOAPpy import Types
+
+class OfflineJira(jira.Jira):
+    """A Jira object with fixed constants that never talks to a server"""
+
+    def __init__(self):
+        self.url = "http://localhost"
+        self.jira = None
+        self.auth = None
+        self.metadata = jira.JiraMetadataCache(self)
+        self.setRegistry(jira.JiraRegistry(
+            [("1", "Open"), ("5", "Resolved")], [("1", "Fixed")],
+            [("1", "Bug"), ("2", "Improvement")], [("3", "Major")]))
+
+def struct(typeName, **fields):
+    s = Types.structType(name=typeName)
+    for k, v in fields.items():
+        s._addItem(k, v)
+    return s
+
+def remoteIssue(n):
+    """A RemoteIssue shaped like the ones SOAPpy builds for getIssuesFromFilter"""
+    cfs = [ struct("RemoteCustomFieldValue", customfieldId="customfield_%d" % i,
+                   key=None, values=["value %d of issue %d" % (i, n)])
+            for i in range(10) ]
+    return struct("RemoteIssue", key="CA-%d" % n, id=str(10000 + n),
+                  project="CA", type=str(1 + n % 2), status=str(1 + 4 * (n % 2)),
+                  priority="3", resolution=None,
+                  summary="Summary of issue %d" % n,
+                  description="Description of issue %d. " % n * 20,
+                  environment="XenServer build %d" % n,
+                  assignee="user%d" % (n % 300), reporter="user%d" % (n % 50),
+                  created=(2009, 1, 2, 3, 4, 5.0),
+                  updated=(2009, 2, 3, 4, 5, 6.0), duedate=None, votes=0,
+                  fixVersions=[struct("RemoteVersion", id="500", name="5.6",
+                                      archived=False, released=True,
+                                      sequence=1, releaseDate=None)],
+                  affectsVersions=[],
+                  components=[struct("RemoteComponent", id="20",
+                                     name="Storage")],
+                  attachmentNames=[], customFieldValues=cfs)
+
+def deepSize(objs, stop):
+    """Bytes held by objs and everything they reference, apart from the
+    objects in stop (shared state such as the Jira connection)"""
+    seen = set([ id(o) for o in stop ])
+    todo = list(objs)
+    size = 0
+    while todo:
+        o = todo.pop()
+        if id(o) in seen or isinstance(o, type):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        todo.extend(gc.get_referents(o))
+    return size
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--issues", type=int, default=20000)
+    args = parser.parse_args()
+
+    j = OfflineJira()
+    stop = [j, j.__dict__, jira.JiraIssue, jira.JiraIssueSnapshot]
+    print "%d issues" % args.issues
+    for name, make in (("JiraIssue", lambda ri: jira.JiraIssue(ri, jira=j)),
+                       ("JiraIssueSnapshot",
+                        lambda ri: jira.JiraIssueSnapshot(ri, j))):
+        remotes = [ remoteIssue(n) for n in range(args.issues) ]
+        start = time.time()
+        issues = [ make(ri) for ri in remotes ]
+        elapsed = time.time() - start
+        del remotes
+        size = deepSize(issues, stop)
+        print "%-18s %8.1f MB retained  %6d bytes/issue  %6.0f ms to build" % (
+            name, size / 1048576.0, size / args.issues, elapsed * 1000)
+        del issues
+
+if __name__ == "__main__":
+    main()
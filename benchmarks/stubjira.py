@@ -0,0 +1,675 @@
+#!/usr/bin/env python
+# Copyright (C) 2006-2009 Citrix Systems Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation; version 2.1 only. with the special
+# exception on linking described in file LICENSE.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+"""A local stand-in for a JIRA server, for running jira.py offline.
+
+StubJira serves the SOAP WSDL, the SOAP operations jira.py uses and the
+issue XML, LinkExistingIssue, DeleteLink, attachment and original estimate
+servlets, from a synthetic project held in memory. Every request can be
+delayed by a fixed latency, and the number of requests is counted by
+operation so that round trips can be compared between versions.
+
+    stub = StubJira(issues=200, latency=0.005)
+    url = stub.start()
+    j = jira.Jira(url, "user", "password")
+    ...
+    print stub.getCounts()
+    stub.stop()
+
+Usage as a script: stubjira.py [--port N] [--issues N] [--latency S]
+"""
+
+import os, sys, re, time, calendar, threading, base64, cgi, urlparse
+import argparse
+import BaseHTTPServer, SocketServer
+import xml.sax.saxutils
+
+import SOAPpy
+from SOAPpy import Types
+
+NAMESPACE = "http://soap.rpc.jira.atlassian.com"
+SOAP_PATH = "/rpc/soap/jirasoapservice-v2"
+
+STATUSES = [("1", "Open"), ("3", "In Progress"), ("4", "Reopened"),
+            ("5", "Resolved"), ("6", "Closed")]
+RESOLUTIONS = [("1", "Fixed"), ("2", "Won't Fix"), ("3", "Duplicate")]
+TYPES = [("1", "Bug"), ("2", "New Feature"), ("3", "Task"),
+         ("4", "Improvement")]
+SUBTASK_TYPES = [("5", "Sub-task")]
+PRIORITIES = [("1", "Blocker"), ("2", "Critical"), ("3", "Major"),
+              ("4", "Minor"), ("5", "Trivial")]
+
+# Link description:(link type id, inward description)
+LINK_TYPES = {"blocks": ("10000", "is blocked by"),
+              "duplicates": ("10001", "is duplicated by"),
+              "relates to": ("10002", "relates to")}
+
+class StubFault(Exception):
+    """Raised by an operation to answer with a SOAP fault"""
+    pass
+
+def _struct(typeName, fields):
+    s = Types.structType(name=typeName)
+    for k, v in fields:
+        s._addItem(k, v)
+    return s
+
+class StubJira:
+    """A synthetic JIRA project served over HTTP on 127.0.0.1.
+
+    issues issues are created in project CA, every (subtasks + 1)th one
+    being the parent of the following subtasks. Each issue blocks the next
+    links issues, has comments comments and customFields custom field
+    values, and a description of descriptionSize bytes. Attachments
+    added through SOAP are kept in memory; attachments are also created
+    for the first attachmentIssues issues, of attachmentSize bytes each.
+    latency seconds are slept before answering every request."""
+
+    def __init__(self, issues=100, latency=0.0, descriptionSize=200,
+                 comments=5, links=2, subtasks=2, customFields=10,
+                 attachmentIssues=0, attachmentSize=65536, users=50):
+        self.latency = latency
+        self.customFields = customFields
+        self.lock = threading.RLock()
+        self.counts = {}
+        self.server = None
+        # Reported by getServerInfo; change it to simulate an upgrade
+        self.buildNumber = "591"
+
+        self.issues = {}
+        self.order = []
+        self.ids = {}
+        self.comments = {}
+        self.attachments = {}
+        self.attachmentData = {}
+        self.links = []
+        self.versions = [ {"id": str(500 + i), "name": "5.%d" % i}
+                          for i in range(5) ]
+        self.users = dict([ ("user%d" % i, "User Number %d" % i)
+                            for i in range(users) ])
+        self.nextAttachment = 1
+        self.nextIssue = 1
+
+        for n in range(1, issues + 1):
+            key = self._newIssue({
+                "summary": "Summary of issue %d" % n,
+                "description": ("Description of issue %d. " % n *
+                                descriptionSize)[:descriptionSize],
+                "customFieldValues": [ ("customfield_%d" % (10000 + i),
+                                        ["value %d" % n])
+                                       for i in range(customFields) ]})
+            self.comments[key] = [ {"id": str(n * 1000 + i),
+                                    "author": "user%d" % (i % users),
+                                    "body": "Comment %d on %s" % (i, key)}
+                                   for i in range(comments) ]
+            if subtasks and (n - 1) % (subtasks + 1):
+                parent = "CA-%d" % (n - (n - 1) % (subtasks + 1))
+                self.issues[key]["parent"] = parent
+                self.issues[key]["type"] = SUBTASK_TYPES[0][0]
+            if n <= attachmentIssues:
+                self._attach(key, "attachment-%d.bin" % n,
+                             os.urandom(attachmentSize))
+        for n in range(1, issues + 1):
+            for i in range(1, links + 1):
+                if n + i <= issues:
+                    self.links.append(("10000", "CA-%d" % n, "CA-%d" % (n + i)))
+
+    # Server
+
+    def start(self, port=0):
+        """Start serving in a background thread and return the base URL"""
+        self.server = _StubServer(("127.0.0.1", port), _StubHandler)
+        self.server.stub = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        return self.url
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def count(self, operation):
+        with self.lock:
+            self.counts[operation] = self.counts.get(operation, 0) + 1
+
+    def getCounts(self):
+        """Return a dictionary of operation:requests since the last reset"""
+        with self.lock:
+            return dict(self.counts)
+
+    def resetCounts(self):
+        with self.lock:
+            self.counts = {}
+
+    def getRoundTrips(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+    # Data
+
+    def _newIssue(self, fields):
+        with self.lock:
+            n = self.nextIssue
+            self.nextIssue += 1
+            key = "CA-%d" % n
+            issue = {"key": key, "id": str(10000 + n), "project": "CA",
+                     "type": "1", "status": "1", "priority": "3",
+                     "resolution": None, "summary": "", "description": None,
+                     "environment": None, "assignee": "user%d" % (n % 7),
+                     "reporter": "user%d" % (n % 5),
+                     "created": time.gmtime(), "updated": time.gmtime(),
+                     "fixVersions": [], "affectsVersions": [],
+                     "components": [], "customFieldValues": [],
+                     "parent": None, "version": 1}
+            issue.update(fields)
+            self.issues[key] = issue
+            self.order.append(key)
+            self.ids[issue["id"]] = key
+            self.comments.setdefault(key, [])
+            return key
+
+    def _issue(self, key):
+        issue = self.issues.get(key)
+        if issue is None:
+            raise StubFault("com.atlassian.jira.rpc.exception."
+                            "RemotePermissionException: This issue does not "
+                            "exist or you don't have permission to view it.")
+        return issue
+
+    def _touch(self, issue):
+        issue["updated"] = time.gmtime()
+        issue["version"] += 1
+
+    def _attach(self, key, name, data):
+        with self.lock:
+            id = str(self.nextAttachment)
+            self.nextAttachment += 1
+            self.attachments.setdefault(key, []).append(
+                {"id": id, "filename": name, "filesize": str(len(data)),
+                 "author": "user0", "mimetype": "application/octet-stream"})
+            self.attachmentData[id] = data
+
+    def _remoteIssue(self, issue):
+        versions = dict([ (v["id"], v["name"]) for v in self.versions ])
+        return _struct("RemoteIssue", [
+            ("id", issue["id"]), ("key", issue["key"]),
+            ("project", issue["project"]), ("type", issue["type"]),
+            ("status", issue["status"]), ("priority", issue["priority"]),
+            ("resolution", issue["resolution"]),
+            ("summary", issue["summary"]),
+            ("description", issue["description"]),
+            ("environment", issue["environment"]),
+            ("assignee", issue["assignee"]), ("reporter", issue["reporter"]),
+            ("created", Types.dateTimeType(issue["created"][:6])),
+            ("updated", Types.dateTimeType(issue["updated"][:6])),
+            ("duedate", None), ("votes", 0),
+            ("fixVersions", [ _struct("RemoteVersion",
+                                      [("id", id), ("name", versions.get(id)),
+                                       ("archived", False),
+                                       ("released", False)])
+                              for id in issue["fixVersions"] ]),
+            ("affectsVersions", [ _struct("RemoteVersion",
+                                          [("id", id),
+                                           ("name", versions.get(id))])
+                                  for id in issue["affectsVersions"] ]),
+            ("components", [ _struct("RemoteComponent",
+                                     [("id", id), ("name", "Component %s" % id)])
+                             for id in issue["components"] ]),
+            ("customFieldValues", [ _struct("RemoteCustomFieldValue",
+                                            [("customfieldId", id),
+                                             ("key", None),
+                                             ("values", list(values))])
+                                    for id, values in
+                                    issue["customFieldValues"] ]),
+            ("attachmentNames", [ a["filename"] for a in
+                                  self.attachments.get(issue["key"], []) ])])
+
+    def _setFields(self, issue, fieldValues):
+        for field in fieldValues:
+            id = field["id"]
+            values = field["values"] or []
+            if isinstance(values, basestring):
+                # JIRA takes a single value as well as an array
+                values = [values]
+            values = list(values)
+            if id.startswith("customfield_"):
+                others = [ (i, v) for i, v in issue["customFieldValues"]
+                           if i != id ]
+                issue["customFieldValues"] = others + [(id, values)]
+            elif id in ("fixVersions", "affectsVersions", "components"):
+                issue[id] = values
+            elif issue.has_key(id):
+                issue[id] = values and values[0] or None
+        self._touch(issue)
+
+    def issueXml(self, issue):
+        """The XML view of an issue, as served by the issue-xml servlet"""
+        key = issue["key"]
+        q = xml.sax.saxutils.escape
+        out = ['<?xml version="1.0" encoding="UTF-8"?>\n<rss version="0.92">'
+               '<channel><title>Stub JIRA</title><item>',
+               '<title>[%s] %s</title>' % (key, q(issue["summary"])),
+               '<description>%s</description>' % q(issue["description"] or ""),
+               '<key id="%s">%s</key>' % (issue["id"], key),
+               '<summary>%s</summary>' % q(issue["summary"])]
+        if issue["parent"]:
+            parent = self.issues[issue["parent"]]
+            out.append('<parent id="%s">%s</parent>' % (parent["id"],
+                                                         parent["key"]))
+        out.append('<comments>')
+        for c in self.comments.get(key, []):
+            out.append('<comment id="%s" author="%s">%s</comment>' %
+                       (c["id"], c["author"], q(c["body"])))
+        out.append('</comments><issuelinks>')
+        for desc, (linktype, inward) in LINK_TYPES.items():
+            outwards = [ dst for t, src, dst in self.links
+                         if t == linktype and src == key ]
+            inwards = [ src for t, src, dst in self.links
+                        if t == linktype and dst == key ]
+            if not outwards and not inwards:
+                continue
+            out.append('<issuelinktype id="%s"><name>%s</name>' %
+                       (linktype, desc))
+            for description, keys, tag in ((desc, outwards, "outwardlinks"),
+                                            (inward, inwards, "inwardlinks")):
+                if keys:
+                    out.append('<%s description="%s">' % (tag, description))
+                    for k in keys:
+                        out.append('<issuelink><issuekey id="%s">%s</issuekey>'
+                                   '</issuelink>' % (self.issues[k]["id"], k))
+                    out.append('</%s>' % (tag))
+            out.append('</issuelinktype>')
+        out.append('</issuelinks><subtasks>')
+        for k in self.order:
+            if self.issues[k]["parent"] == key:
+                out.append('<subtask id="%s">%s</subtask>' %
+                           (self.issues[k]["id"], k))
+        out.append('</subtasks><customfields>')
+        for id, values in issue["customFieldValues"]:
+            out.append('<customfield id="%s"><customfieldvalues>%s'
+                       '</customfieldvalues></customfield>' %
+                       (id, "".join([ '<customfieldvalue>%s</customfieldvalue>'
+                                      % q(str(v)) for v in values ])))
+        out.append('</customfields></item></channel></rss>')
+        return "".join(out)
+
+    # SOAP operations, called with the SOAP arguments
+
+    def soap_login(self, username, password):
+        return "stub-token"
+
+    def soap_getServerInfo(self, auth):
+        return {"version": "4.2", "buildNumber": self.buildNumber,
+                "baseUrl": "http://localhost"}
+
+    def soap_getStatuses(self, auth):
+        return [ {"id": id, "name": name} for id, name in STATUSES ]
+
+    def soap_getResolutions(self, auth):
+        return [ {"id": id, "name": name} for id, name in RESOLUTIONS ]
+
+    def soap_getIssueTypes(self, auth):
+        return [ {"id": id, "name": name} for id, name in TYPES ]
+
+    def soap_getSubTaskIssueTypes(self, auth):
+        return [ {"id": id, "name": name} for id, name in SUBTASK_TYPES ]
+
+    def soap_getPriorities(self, auth):
+        return [ {"id": id, "name": name} for id, name in PRIORITIES ]
+
+    def soap_getIssue(self, auth, key):
+        return self._remoteIssue(self._issue(key))
+
+    def soap_getIssuesFromFilter(self, auth, filterId):
+        return self.soap_getIssuesFromFilterWithLimit(auth, filterId, 0,
+                                                      len(self.order))
+
+    def soap_getIssuesFromFilterWithLimit(self, auth, filterId, offset,
+                                          maxResults):
+        if str(filterId) != "10000":
+            raise StubFault("com.atlassian.jira.rpc.exception."
+                            "RemoteValidationException: Filter does not exist")
+        keys = self.order[int(offset):int(offset) + int(maxResults)]
+        return [ self._remoteIssue(self.issues[k]) for k in keys ]
+
+    def soap_getIssuesFromJqlSearch(self, auth, jql, maxResults):
+        # Only an 'updated >= "-Nm"' bound and ordering by update time are
+        # understood, the rest of the query matches every issue
+        keys = list(self.order)
+        bound = re.search(r'updated >= "-(\d+)m"', jql)
+        if bound:
+            start = time.time() - int(bound.group(1)) * 60
+            keys = [ k for k in keys
+                     if calendar.timegm(self.issues[k]["updated"]) >= start ]
+        if re.search(r"ORDER BY updated", jql, re.I):
+            keys.sort(key=lambda k: self.issues[k]["updated"])
+        return [ self._remoteIssue(self.issues[k])
+                 for k in keys[:int(maxResults)] ]
+
+    def soap_getSavedFilters(self, auth):
+        return [ {"id": "10000", "name": "All issues", "author": "user0",
+                  "description": "Every issue in CA", "project": None} ]
+
+    def soap_getFieldsForEdit(self, auth, key):
+        self._issue(key)
+        fields = [ {"id": id, "name": id.capitalize()}
+                   for id in ("summary", "description", "environment",
+                              "priority", "fixVersions") ]
+        return fields + [ {"id": "customfield_%d" % (10000 + i),
+                           "name": "Field %d" % i}
+                          for i in range(self.customFields) ]
+
+    def soap_getFieldsForCreate(self, auth, project, typeId):
+        return self.soap_getFieldsForEdit(auth, self.order[0])
+
+    def soap_createIssue(self, auth, remoteIssue):
+        fields = {}
+        for name in ("project", "summary", "type", "priority", "description",
+                     "environment", "assignee"):
+            if remoteIssue._asdict().has_key(name):
+                fields[name] = remoteIssue[name]
+        for name in ("components", "affectsVersions", "fixVersions"):
+            if remoteIssue._asdict().has_key(name):
+                fields[name] = [ v["id"] for v in remoteIssue[name] or [] ]
+        if remoteIssue._asdict().has_key("customFieldValues"):
+            fields["customFieldValues"] = [
+                (cf["customfieldId"], list(cf["values"]))
+                for cf in remoteIssue["customFieldValues"] or [] ]
+        key = self._newIssue(fields)
+        return self._remoteIssue(self.issues[key])
+
+    def soap_updateIssue(self, auth, key, fieldValues):
+        with self.lock:
+            issue = self._issue(key)
+            self._setFields(issue, fieldValues)
+            return self._remoteIssue(issue)
+
+    def soap_progressWorkflowAction(self, auth, key, action, fieldValues):
+        with self.lock:
+            issue = self._issue(key)
+            issue["status"] = "5"
+            self._setFields(issue, [ f for f in fieldValues
+                                     if f["id"] != "resolution" ])
+            for f in fieldValues:
+                if f["id"] == "resolution":
+                    issue["resolution"] = f["values"][0]
+            return self._remoteIssue(issue)
+
+    def soap_deleteIssue(self, auth, key):
+        with self.lock:
+            self._issue(key)
+            del self.issues[key]
+            self.order.remove(key)
+
+    def soap_addComment(self, auth, key, comment):
+        with self.lock:
+            issue = self._issue(key)
+            comments = self.comments[key]
+            comments.append({"id": str(900000 + len(comments)),
+                             "author": "user0", "body": comment["body"]})
+            self._touch(issue)
+
+    def soap_getComments(self, auth, key):
+        self._issue(key)
+        return [ dict(c) for c in self.comments[key] ]
+
+    def soap_addAttachmentsToIssue(self, auth, key, names, datas):
+        issue = self._issue(key)
+        for name, chunks in zip(names, datas):
+            self._attach(key, name, base64.decodestring("".join(chunks)))
+        self._touch(issue)
+        return True
+
+    def soap_getAttachmentsFromIssue(self, auth, key):
+        self._issue(key)
+        return [ dict(a) for a in self.attachments.get(key, []) ]
+
+    def soap_getVersions(self, auth, project):
+        return [ dict(v, released=False, archived=False, sequence=i)
+                 for i, v in enumerate(self.versions) ]
+
+    def soap_addVersion(self, auth, project, version):
+        with self.lock:
+            v = {"id": str(500 + len(self.versions)), "name": version["name"]}
+            self.versions.append(v)
+            return dict(v)
+
+    def soap_getProjectByKey(self, auth, project):
+        if project != "CA":
+            raise StubFault("com.atlassian.jira.rpc.exception."
+                            "RemoteException: Project does not exist")
+        return {"id": "10000", "key": "CA", "name": "Stub project",
+                "lead": "user0"}
+
+    def soap_getComponents(self, auth, project):
+        return [ {"id": str(i), "name": "Component %d" % i}
+                 for i in range(1, 4) ]
+
+    def soap_getUser(self, auth, username):
+        if not self.users.has_key(username):
+            return None
+        return {"name": username, "fullname": self.users[username],
+                "email": "%s@example.com" % username}
+
+    def soap_getGroup(self, auth, groupName):
+        if groupName != "jira-users":
+            raise StubFault("com.atlassian.jira.rpc.exception."
+                            "RemoteValidationException: Group does not exist")
+        return {"name": groupName,
+                "users": [ self.soap_getUser(auth, u)
+                           for u in sorted(self.users) ]}
+
+    # Servlets, called with the query or form parameters
+
+    def http_link(self, params):
+        with self.lock:
+            key = self.ids[params["id"]]
+            desc = params["linkDesc"]
+            linktype = LINK_TYPES.get(desc, LINK_TYPES["relates to"])[0]
+            self._issue(params["linkKey"])
+            self.links.append((linktype, key, params["linkKey"]))
+            self._touch(self.issues[key])
+            self._touch(self.issues[params["linkKey"]])
+
+    def http_deleteLink(self, params):
+        with self.lock:
+            src = self.ids[params["id"]]
+            dst = self.ids[params["destId"]]
+            self.links = [ l for l in self.links
+                           if not (l[0] == params["linkType"] and
+                                   set(l[1:]) == set([src, dst])) ]
+            self._touch(self.issues[src])
+            self._touch(self.issues[dst])
+
+    def http_estimate(self, params):
+        self._issue(params["issue"])
+        return "3600\n"
+
+def _soapValue(value):
+    """Make plain dictionaries in a return value into SOAP structs"""
+    if isinstance(value, dict):
+        return _struct("item", [ (k, _soapValue(v))
+                                 for k, v in sorted(value.items()) ])
+    if isinstance(value, list):
+        return [ _soapValue(v) for v in value ]
+    return value
+
+def _wsdl(url, operations):
+    """A minimal rpc/encoded WSDL listing operations, enough for SOAPpy"""
+    encoded = ('<wsdlsoap:body use="encoded" namespace="%s" encodingStyle='
+               '"http://schemas.xmlsoap.org/soap/encoding/"/>' % NAMESPACE)
+    messages = []
+    portType = []
+    binding = []
+    for op in operations:
+        messages.append('<wsdl:message name="%sRequest"/>'
+                        '<wsdl:message name="%sResponse">'
+                        '<wsdl:part name="%sReturn" type="xsd:anyType"/>'
+                        '</wsdl:message>' % (op, op, op))
+        portType.append('<wsdl:operation name="%s">'
+                        '<wsdl:input message="impl:%sRequest"/>'
+                        '<wsdl:output message="impl:%sResponse"/>'
+                        '</wsdl:operation>' % (op, op, op))
+        binding.append('<wsdl:operation name="%s">'
+                       '<wsdlsoap:operation soapAction=""/>'
+                       '<wsdl:input>%s</wsdl:input>'
+                       '<wsdl:output>%s</wsdl:output></wsdl:operation>' %
+                       (op, encoded, encoded))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<wsdl:definitions targetNamespace="%(ns)s" xmlns:impl="%(ns)s" '
+            'xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" '
+            'xmlns:wsdlsoap="http://schemas.xmlsoap.org/wsdl/soap/" '
+            'xmlns:xsd="http://www.w3.org/2001/XMLSchema">%(messages)s'
+            '<wsdl:portType name="JiraSoapService">%(portType)s'
+            '</wsdl:portType><wsdl:binding name="jirasoapservice-v2SoapBinding" '
+            'type="impl:JiraSoapService"><wsdlsoap:binding style="rpc" '
+            'transport="http://schemas.xmlsoap.org/soap/http"/>%(binding)s'
+            '</wsdl:binding><wsdl:service name="JiraSoapServiceService">'
+            '<wsdl:port binding="impl:jirasoapservice-v2SoapBinding" '
+            'name="jirasoapservice-v2"><wsdlsoap:address location="%(url)s%(path)s"/>'
+            '</wsdl:port></wsdl:service></wsdl:definitions>' %
+            {"ns": NAMESPACE, "messages": "".join(messages),
+             "portType": "".join(portType), "binding": "".join(binding),
+             "url": url, "path": SOAP_PATH})
+
+class _StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, contentType="text/xml", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect(self):
+        self._send(302, "", "text/html", [("Location", "/browse/CA-1")])
+
+    def do_GET(self):
+        stub = self.server.stub
+        time.sleep(stub.latency)
+        parts = urlparse.urlsplit(self.path)
+        path = parts.path
+        params = dict(cgi.parse_qsl(parts.query))
+
+        if path == SOAP_PATH:
+            stub.count("wsdl")
+            operations = [ name[5:] for name in dir(stub)
+                           if name.startswith("soap_") ]
+            host = self.headers.get("Host")
+            self._send(200, _wsdl("http://%s" % host, operations))
+        elif path.startswith("/si/jira.issueviews:issue-xml/"):
+            stub.count("issue-xml")
+            key = path.split("/")[3]
+            with stub.lock:
+                issue = stub.issues.get(key)
+                if issue is None:
+                    self._send(404, "Not found", "text/plain")
+                    return
+                etag = '"%s-%d"' % (key, issue["version"])
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, "", headers=[("ETag", etag)])
+                    return
+                body = stub.issueXml(issue)
+            self._send(200, body, headers=[("ETag", etag)])
+        elif path.startswith("/secure/attachment/"):
+            stub.count("attachment")
+            data = stub.attachmentData.get(path.split("/")[3])
+            if data is None:
+                self._send(404, "Not found", "text/plain")
+            else:
+                self._send(200, data, "application/octet-stream")
+        elif path == "/secure/DeleteLink.jspa":
+            stub.count("DeleteLink")
+            stub.http_deleteLink(params)
+            self._redirect()
+        else:
+            stub.count("other")
+            self._send(404, "Not found", "text/plain")
+
+    def do_POST(self):
+        stub = self.server.stub
+        time.sleep(stub.latency)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlparse.urlsplit(self.path).path
+
+        if path == SOAP_PATH:
+            self._soap(stub, body)
+        elif path == "/secure/LinkExistingIssue.jspa":
+            stub.count("LinkExistingIssue")
+            try:
+                stub.http_link(dict(cgi.parse_qsl(body)))
+            except StubFault:
+                self._send(404, "Not found", "text/plain")
+                return
+            self._redirect()
+        elif path == "/plugins/servlet/xenrt/issue_getoriginalestimate":
+            stub.count("estimate")
+            try:
+                self._send(200, stub.http_estimate(dict(cgi.parse_qsl(body))),
+                           "text/plain")
+            except StubFault, e:
+                self._send(200, str(e), "text/plain")
+        else:
+            stub.count("other")
+            self._send(404, "Not found", "text/plain")
+
+    def _soap(self, stub, body):
+        call = SOAPpy.parseSOAPRPC(body)
+        name = str(call._name)
+        stub.count(name)
+        method = getattr(stub, "soap_" + name, None)
+        try:
+            if method is None:
+                raise StubFault("No such operation %s" % (name))
+            result = method(*call._aslist())
+        except StubFault, e:
+            fault = Types.faultType("%s:Server.userException" %
+                                    SOAPpy.NS.ENV_T, str(e))
+            self._send(500, SOAPpy.buildSOAP(fault))
+            return
+        self._send(200, SOAPpy.buildSOAP(kw={"%sReturn" % name:
+                                             _soapValue(result)},
+                                         method=name + "Response",
+                                         namespace=NAMESPACE))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--issues", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = StubJira(issues=args.issues, latency=args.latency)
+    print "Serving %d issues at %s" % (args.issues, stub.start(args.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
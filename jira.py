@@ -12,70 +12,496 @@
 
 import SOAPpy
 from SOAPpy import Types
-import re, os.path, base64, urllib, urllib2
-import xml.dom.minidom
+import re, os, os.path, base64, urllib, urlparse, tempfile
+import httplib, socket, errno
+import xml.etree.cElementTree as ElementTree
 import array
 import time
+import threading
+import Queue
+import contextlib
+import json
+import hashlib
+import calendar
+import math
+import sqlite3
+import collections
+import random
+import bisect
+import logging
 
 _jira = None
 
+_log = logging.getLogger("jira")
+_log.addHandler(logging.NullHandler())
+
+class JiraError(Exception):
+    """Base class for errors raised by this module. The underlying exception,
+    if any, is kept as cause."""
+
+    def __init__(self, message, cause=None):
+        Exception.__init__(self, message)
+        self.cause = cause
+
+class JiraNotFound(JiraError):
+    """The requested object does not exist or is not visible to this login"""
+    pass
+
+class JiraHTTPError(JiraError):
+    """A servlet or JSP request got an HTTP error status"""
+
+    def __init__(self, message, status, cause=None):
+        JiraError.__init__(self, message, cause)
+        self.status = status
+
+class JiraTransientError(JiraError):
+    """A remote call failed in a way that may succeed later (a network
+    error, timeout or overloaded server), and was not or no longer retried"""
+    pass
+
+# Errors after which a remote call is worth retrying
+_TRANSIENT_ERRORS = (socket.error, httplib.HTTPException, JiraTransientError)
+
+# HTTP statuses of a server or proxy that is temporarily unavailable
+_TRANSIENT_STATUSES = (502, 503, 504)
+
+def _isStaleConnection(e):
+    """Whether an error on a reused keep-alive connection means the server
+    had closed it, so that it cannot have read the request"""
+    if isinstance(e, httplib.BadStatusLine):
+        return not e.line or e.line.startswith("No status line")
+    return isinstance(e, socket.error) and \
+           not isinstance(e, socket.timeout) and \
+           e.errno in (errno.ECONNRESET, errno.EPIPE)
+
+def _isNotFoundFault(fault):
+    """Whether a SOAP fault is JIRA reporting a missing (or hidden) object"""
+    text = str(fault)
+    return "RemotePermissionException" in text or "does not exist" in text
+
+# Call profiles (see Jira.profile) of the current thread, as a tuple of
+# (JiraInstrumentation, JiraCallStats) pairs
+_profiles = threading.local()
+
+def _activeProfiles():
+    return getattr(_profiles, "active", ())
+
+def _withProfiles(profiles, func):
+    """Returns a function calling func with the given call profiles active,
+    for threads doing work on behalf of the one that started them"""
+    def call(*args):
+        saved = _activeProfiles()
+        _profiles.active = profiles
+        try:
+            return func(*args)
+        finally:
+            _profiles.active = saved
+    return call
+
+def _runConcurrently(func, items, maxWorkers):
+    """Call func on each of items using at most maxWorkers threads. Returns a
+    list of (value, exception) pairs in the same order as items."""
+
+    func = _withProfiles(_activeProfiles(), func)
+    results = [None] * len(items)
+    queue = Queue.Queue()
+    for i, item in enumerate(items):
+        queue.put((i, item))
+
+    def worker():
+        while True:
+            try:
+                i, item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = (func(item), None)
+            except Exception, e:
+                results[i] = (None, e)
+
+    threads = [ threading.Thread(target=worker)
+                for i in range(min(maxWorkers, len(items))) ]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def _encodeFile(path, chunkSize=57*16384):
+    """Returns the base64 encoding of the file at path, as
+    base64.encodestring would. The file is read and encoded chunkSize bytes
+    at a time (a multiple of 57, the input size of one encoded line), so it
+    is never held in memory unencoded."""
+
+    pieces = []
+    f = file(path, "rb")
+    try:
+        while True:
+            data = f.read(chunkSize)
+            if not data:
+                break
+            pieces.append(base64.encodestring(data))
+    finally:
+        f.close()
+    return "".join(pieces)
+
+class JiraResult:
+    """The outcome for one key of a batch operation: value on success,
+    otherwise the exception in error"""
+
+    def __init__(self, key, value=None, error=None):
+        self.key = key
+        self.value = value
+        self.error = error
+
+    def ok(self):
+        return self.error is None
+
+class JiraNameIndex:
+    """Read-only two-way index between the ids and names of one kind of
+    JIRA constant, e.g. the statuses"""
+
+    def __init__(self, pairs):
+        self._pairs = tuple([ (str(id), name) for id, name in pairs ])
+        self._names = dict(self._pairs)
+        self._ids = dict([ (name, id) for id, name in self._pairs ])
+
+    def getName(self, id, default=None):
+        return self._names.get(str(id), default)
+
+    def getId(self, name, default=None):
+        return self._ids.get(name, default)
+
+    def name(self, id):
+        """Returns the name for id, raising KeyError if it is unknown"""
+        return self._names[str(id)]
+
+    def id(self, name):
+        """Returns the id for name, raising KeyError if it is unknown"""
+        return self._ids[name]
+
+    def items(self):
+        """Returns the (id, name) pairs in server order"""
+        return list(self._pairs)
+
+    def byId(self):
+        """Returns a new dictionary of id:name"""
+        return dict(self._names)
+
+    def byName(self):
+        """Returns a new dictionary of name:id"""
+        return dict(self._ids)
+
+class JiraRegistry:
+    """The statuses, resolutions, issue types and priorities of one server,
+    each as a JiraNameIndex. Instances are not modified after creation; use
+    load() again to pick up server changes."""
+
+    KINDS = ('statuses', 'resolutions', 'types', 'priorities')
+
+    def __init__(self, statuses, resolutions, types, priorities):
+        self.statuses = JiraNameIndex(statuses)
+        self.resolutions = JiraNameIndex(resolutions)
+        self.types = JiraNameIndex(types)
+        self.priorities = JiraNameIndex(priorities)
+
+    @staticmethod
+    def load(soap, auth, maxWorkers=1):
+        """Fetch all the constants from the server, making up to maxWorkers
+        calls at once"""
+        methods = ['getStatuses', 'getResolutions', 'getIssueTypes',
+                   'getSubTaskIssueTypes', 'getPriorities']
+        results = _runConcurrently(lambda m: getattr(soap, m)(auth), methods,
+                                   maxWorkers)
+        pairs = []
+        for remotes, error in results:
+            if error:
+                raise error
+            pairs.append([ (r.id, r.name) for r in remotes ])
+        statuses, resolutions, types, subtaskTypes, priorities = pairs
+        return JiraRegistry(statuses, resolutions, types + subtaskTypes,
+                            priorities)
+
+    def toDict(self):
+        d = {}
+        for kind in self.KINDS:
+            d[kind] = getattr(self, kind).items()
+        return d
+
+    @staticmethod
+    def fromDict(d):
+        return JiraRegistry(*[ d[kind] for kind in JiraRegistry.KINDS ])
+
+    def save(self, path):
+        """Write the registry to path as JSON"""
+        f = file(path, "w")
+        try:
+            json.dump(self.toDict(), f)
+        finally:
+            f.close()
+
+    @staticmethod
+    def read(path):
+        """Read a registry written by save()"""
+        f = file(path)
+        try:
+            return JiraRegistry.fromDict(json.load(f))
+        finally:
+            f.close()
+
+class JiraDiskCache:
+    """On-disk cache of a server's WSDL and JiraRegistry, so that creating a
+    Jira object does not have to download and parse them every time.
+
+    Files are named after a hash of the server URL and written atomically.
+    Entries older than ttl seconds, written by a different cache VERSION, or
+    whose WSDL does not match the one they were saved with are ignored. The
+    server's build is stored too: see getServer() to check for upgrades."""
+
+    VERSION = 1
+
+    def __init__(self, directory, url, ttl=86400):
+        self.url = url
+        self.ttl = ttl
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = hashlib.sha1(url).hexdigest()
+        self.wsdlPath = os.path.join(directory, name + ".wsdl")
+        self.metaPath = os.path.join(directory, name + ".json")
+
+    def _write(self, path, data):
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       prefix=".jira-")
+        try:
+            f = os.fdopen(fd, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmpname, path)
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def _readMeta(self):
+        try:
+            f = file(self.metaPath)
+            try:
+                meta = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+        if meta.get('version') != self.VERSION or meta.get('url') != self.url:
+            return None
+        if self.ttl is not None and time.time() - meta['created'] > self.ttl:
+            return None
+        return meta
+
+    def _wsdlDigest(self):
+        try:
+            f = file(self.wsdlPath, "rb")
+        except IOError:
+            return None
+        try:
+            return hashlib.sha1(f.read()).hexdigest()
+        finally:
+            f.close()
+
+    def get(self):
+        """Returns (path of the cached WSDL, cached JiraRegistry), or None
+        if there is no usable entry"""
+        meta = self._readMeta()
+        if meta and meta.get('wsdl') == self._wsdlDigest():
+            return self.wsdlPath, JiraRegistry.fromDict(meta['registry'])
+        return None
+
+    def getServer(self):
+        """Returns the server build stored with the registry, or None"""
+        meta = self._readMeta()
+        return meta and meta.get('server')
+
+    def putWsdl(self, wsdl):
+        """Store the WSDL document"""
+        self._write(self.wsdlPath, wsdl)
+
+    def putRegistry(self, registry, server=None):
+        """Store the registry loaded using the stored WSDL, from the given
+        server build"""
+        meta = {'version': self.VERSION, 'url': self.url,
+                'created': time.time(), 'wsdl': self._wsdlDigest(),
+                'server': server, 'registry': registry.toDict()}
+        self._write(self.metaPath, json.dumps(meta))
+
+    def clear(self):
+        for path in (self.wsdlPath, self.metaPath):
+            if os.path.exists(path):
+                os.unlink(path)
+
 class Jira:
 
     StatusResolved = 5
-    STATUS = {}
-    RESOLUTION = {}
-    TYPES = {}
-    PRIORITIES = {}
 
-    def __init__(self,url,username,password):
+    WSDL_PATH = "/rpc/soap/jirasoapservice-v2?wsdl"
+
+    # Seconds for which a cached servlet response is used without asking
+    # the server again, by endpoint
+    RESPONSE_TTLS = {'issue-xml': 300, 'estimate': 3600}
+
+    def __init__(self,url,username,password,metadataTTL=3600,
+                 httpPoolSize=4,httpTimeout=60,cacheDir=None,cacheTTL=86400,
+                 responseCache=None,responseTTLs=None,scheduler=None):
+        """Connect and log in to the JIRA server at url.
+
+        A Jira object can be shared by several threads, and several can be
+        used side by side: every object it returns refers to it explicitly.
+
+        If cacheDir is given, the WSDL and the registry of statuses,
+        resolutions, types and priorities are kept there for cacheTTL
+        seconds (see JiraDiskCache) instead of being fetched every time.
+        They are fetched again when the server reports a different build.
+
+        responseCache, e.g. a JiraResponseCache, keeps the results of the
+        issue XML and original estimate requests; responseTTLs overrides
+        entries of RESPONSE_TTLS.
+
+        Every SOAP and HTTP request goes through scheduler, a JiraScheduler
+        handling timeouts, retries and rate limiting. By default reads are
+        retried and each request times out after httpTimeout seconds.
+        Their timings and sizes are recorded in instrumentation, a
+        JiraInstrumentation; see also profile()."""
         global _jira
         _jira = self
 
         self.url = url
         self.username = username
         self.password = password
+        self.metadata = JiraMetadataCache(self, metadataTTL)
+        self.users = JiraUserDirectory(self, metadataTTL)
+        self.instrumentation = JiraInstrumentation()
+        if scheduler is None:
+            scheduler = JiraScheduler(timeout=httpTimeout)
+        if scheduler.instrumentation is None:
+            scheduler.instrumentation = self.instrumentation
+        self.scheduler = scheduler
+        self.http = JiraHTTPPool(url, httpPoolSize, httpTimeout, scheduler,
+                                 self.instrumentation)
+        self.fieldLoads = {}
+        self.fieldLoadsLock = threading.Lock()
+        self.mirror = None
+        self.responseCache = responseCache
+        self.responseTTLs = dict(self.RESPONSE_TTLS)
+        self.responseTTLs.update(responseTTLs or {})
 
         # Open JIRA connection and login
-        self.jira = SOAPpy.WSDL.Proxy(
-                        "%s/rpc/soap/jirasoapservice-v2?wsdl" % (url))
+        cached = None
+        if cacheDir:
+            self.diskCache = JiraDiskCache(cacheDir, url, cacheTTL)
+            cached = self.diskCache.get()
+        else:
+            self.diskCache = None
+        self._login(cached and cached[0])
+        self.serverBuild = None
+        if self.diskCache:
+            self.serverBuild = self._getServerBuild()
+            if cached and self.serverBuild != self.diskCache.getServer():
+                # Upgraded since the cache was written, the WSDL and the
+                # constants may have changed
+                self.diskCache.clear()
+                cached = None
+                self._login(None)
+
+        # Get statuses, resolutions, types and priorities from Jira...
+        if cached:
+            registry = cached[1]
+        else:
+            registry = JiraRegistry.load(self.jira, self.auth, maxWorkers=5)
+            if self.diskCache:
+                self.diskCache.putRegistry(registry, self.serverBuild)
+        self.setRegistry(registry)
+
+    def _login(self, wsdlPath):
+        """Log in using the WSDL at wsdlPath, or else the server's"""
+        if wsdlPath:
+            wsdl = SOAPpy.WSDL.Proxy(wsdlPath)
+        elif self.diskCache:
+            self.diskCache.putWsdl(self.http.request(self.WSDL_PATH))
+            wsdl = SOAPpy.WSDL.Proxy(self.diskCache.wsdlPath)
+        else:
+            wsdl = SOAPpy.WSDL.Proxy("%s%s" % (self.url, self.WSDL_PATH))
+        self.jira = JiraSoapClient(wsdl, self.scheduler)
         if self.jira:
-            self.auth = self.jira.login(username,password)
+            self.auth = self.jira.login(self.username,self.password)
         else:
             raise Exception("Unable to connect to Jira")
 
-        # Get statuses from Jira...
-        statuses = self.jira.getStatuses(self.auth)
-        for s in statuses:
-            self.STATUS[s.id] = s.name
-        # Get resolutions from Jira...
-        resolutions = self.jira.getResolutions(self.auth)
-        for r in resolutions:
-            self.RESOLUTION[r.id] = r.name
-        # Get types rrom Jira...
-        types = self.jira.getIssueTypes(self.auth) + self.jira.getSubTaskIssueTypes(self.auth)
-        for t in types:
-            self.TYPES[t.id] = t.name
-        # Get priorities from Jira...
-        prios = self.jira.getPriorities(self.auth)
-        for p in prios:
-            self.PRIORITIES[p.id] = p.name
+    def _getServerBuild(self):
+        """Returns the server's version and build number, or None if it
+        does not say"""
+        if not self.jira.hasMethod('getServerInfo'):
+            return None
+        info = self.jira.getServerInfo(self.auth)
+        return "%s-%s" % (info['version'], info['buildNumber'])
+
+    def setRegistry(self, registry):
+        """Use the given JiraRegistry for this connection's constants"""
+        self.registry = registry
+        # Per-connection id:name copies, for compatibility
+        self.STATUS = registry.statuses.byId()
+        self.RESOLUTION = registry.resolutions.byId()
+        self.TYPES = registry.types.byId()
+        self.PRIORITIES = registry.priorities.byId()
+        self.metadata.setPriorities(registry.priorities)
+
+    def refreshMetadata(self):
+        """Discard cached priorities and custom field ids, and reload the
+        registry of statuses, resolutions, types and priorities"""
+        self.metadata.refresh()
+        self.setRegistry(JiraRegistry.load(self.jira, self.auth, maxWorkers=5))
+        if self.diskCache:
+            self.diskCache.putRegistry(self.registry, self.serverBuild)
+
+    def countFieldLoad(self, name):
+        """Record that a lazy JiraIssue loaded the named field"""
+        with self.fieldLoadsLock:
+            self.fieldLoads[name] = self.fieldLoads.get(name, 0) + 1
+
+    def getFieldLoadCounts(self):
+        """Returns a dictionary of field:number of lazy loads"""
+        with self.fieldLoadsLock:
+            return dict(self.fieldLoads)
 
     def getUserFullName(self, user):
-        return self.jira.getUser(self.auth, user)['fullname']
+        profile = self.users.get(user)
+        if profile is None:
+            raise JiraNotFound("User %s not found" % (user))
+        return profile['fullname']
+
+    def getUserFullNames(self, users, maxWorkers=8):
+        """Return a dictionary of username:full name for users, None for
+        users that do not exist. Only users not already known are fetched,
+        with up to maxWorkers concurrent requests."""
+        names = {}
+        for user, profile in self.users.getMany(users, maxWorkers).items():
+            names[user] = profile and profile['fullname']
+        return names
 
     def createIssue(self,project,summary,type,priority,description=None,
                     affectsVersions=None,assignee="-1",components=None,
                     customFields=None,environment=None):
+        """Create an issue and return it as a JiraIssue. customFields is a
+        list of (name, values) pairs, sent with the issue itself when the
+        server can list the fields for creating issues, otherwise set by an
+        update once it is created."""
 
         # Process priority and type
-        for p in self.PRIORITIES:
-            if self.PRIORITIES[p] == priority:
-                priority = p
-                break
-        for t in self.TYPES:
-            if self.TYPES[t] == type:
-                type = t
-                break
+        priority = self.registry.priorities.getId(priority, priority)
+        type = self.registry.types.getId(type, type)
+        try:
+            self.registry.types.name(type)
+        except KeyError:
+            raise JiraNotFound("Issue type %s not found" % (type))
 
         fields = {'project': project, 'summary': summary, 'priority': priority, 'type': type, 'assignee': assignee}
         if description:
@@ -86,44 +512,319 @@ class Jira:
             fields['components'] = components
         if environment:
             fields['environment'] = environment
-        ri = JiraIssue(self.jira.createIssue(self.auth,fields))
+
+        customFieldIds = None
         if customFields:
+            customFieldIds = self._getCreateCustomFields(project, type)
+        if customFieldIds is not None:
+            values = []
+            for name, value in customFields:
+                if not customFieldIds.has_key(name):
+                    raise JiraNotFound("Custom field %s not found in %s" %
+                                       (name, project))
+                values.append({'customfieldId': customFieldIds[name],
+                               'values': value})
+            fields['customFieldValues'] = values
+        ri = JiraIssue(self.jira.createIssue(self.auth,fields), jira=self)
+        if customFields and customFieldIds is None:
             for cf in customFields:
                 ri.setCustomField(cf[0],cf[1],update=False)
             ri.updateCustomFields()
         return ri
 
+    def _getCreateCustomFields(self,project,type):
+        """The custom field name:id map for new issues of the given project
+        and type id, or None if the server cannot list the fields for
+        creating issues"""
+        if not self.jira.hasMethod('getFieldsForCreate'):
+            return None
+        return self.metadata.getCreateCustomFields(project, type)
+
+    def createIssues(self,specs,maxWorkers=8):
+        """Create many issues using up to maxWorkers concurrent requests.
+        specs is a list of dictionaries of createIssue arguments. Returns a
+        list of JiraResult in the order of specs, with the spec as key and
+        the new JiraIssue as the value of each success. Failed creations
+        are not retried."""
+
+        # Look up the custom field ids once per project and type first. A
+        # lookup failing here fails the specs needing it in createIssue.
+        for project, type in set([ (spec.get('project'),
+                                    self.registry.types.getId(spec.get('type'),
+                                                              spec.get('type')))
+                                   for spec in specs
+                                   if spec.get('customFields') ]):
+            try:
+                self.registry.types.name(type)
+                self._getCreateCustomFields(project, type)
+            except Exception:
+                pass
+
+        results = _runConcurrently(lambda spec: self.createIssue(**spec),
+                                   specs, maxWorkers)
+        return [ JiraResult(spec, issue, error)
+                 for spec, (issue, error) in zip(specs, results) ]
+
     def deleteIssue(self,key):
         try:
             self.jira.deleteIssue(self.auth,key)
-        except:
-            raise Exception("Issue %s not found" % (key))
-
-    def getIssue(self,key):
+        except Types.faultType, e:
+            if _isNotFoundFault(e):
+                raise JiraNotFound("Issue %s not found" % (key), e)
+            raise
+
+    def getIssue(self,key,lazy=False):
+        """Return the issue with the given key. With lazy=True nothing is
+        fetched until a field other than the key is accessed."""
+        if lazy:
+            return JiraIssue(key=key, lazy=True, jira=self)
+        return JiraIssue(self.getRemoteIssue(key), jira=self)
+
+    def openMirror(self,path):
+        """Open (creating if needed) the JiraMirror database at path and
+        read issue snapshots through it"""
+        self.mirror = JiraMirror(self, path)
+        return self.mirror
+
+    def getIssueSnapshot(self,key):
+        """Return a JiraIssueSnapshot of the issue, from the mirror if one
+        is open and holds it, otherwise fetched (and then mirrored)"""
+        if self.mirror:
+            snapshot = self.mirror.getIssue(key)
+            if snapshot:
+                return snapshot
+        snapshot = JiraIssueSnapshot(self.getRemoteIssue(key), self)
+        if self.mirror:
+            self.mirror.store([snapshot])
+        return snapshot
+
+    def getRemoteIssue(self,key):
+        """Return the RemoteIssue with the given key, raising JiraNotFound if
+        it does not exist. Other failures are raised as they are."""
         try:
-            ri = self.jira.getIssue(self.auth,key)
-            return JiraIssue(ri)
-        except:
-            raise Exception("Issue %s not found" % (key))
-
-    def getIssuesFromFilter(self,filterId):
+            return self.jira.getIssue(self.auth,key)
+        except Types.faultType, e:
+            if _isNotFoundFault(e):
+                raise JiraNotFound("Issue %s not found" % (key), e)
+            raise
+
+    def getIssues(self,keys,maxWorkers=8):
+        """Fetch the issues with the given keys using up to maxWorkers
+        concurrent requests. Returns a list of JiraResult in the order of
+        keys; a missing issue fails only its own result."""
+        results = _runConcurrently(self.getIssue, keys, maxWorkers)
+        return [ JiraResult(key, issue, error)
+                 for key, (issue, error) in zip(keys, results) ]
+
+    def getIssuesFromFilter(self,filterId,lazy=False,snapshot=False):
+        """Return the issues matching a filter, as JiraIssue objects or,
+        with snapshot=True, as JiraIssueSnapshot objects"""
         try:
             ris = self.jira.getIssuesFromFilter(self.auth,filterId);
-            return [ JiraIssue(i) for i in ris ]
-        except:
-            raise Exception("Filter ID not found")
+        except Types.faultType, e:
+            if _isNotFoundFault(e):
+                raise JiraNotFound("Filter ID not found", e)
+            raise
+        return self.wrapIssues(ris, lazy, snapshot)
+
+    def iterIssuesFromFilter(self,filterId,pageSize=100,lazy=False,
+                             snapshot=False):
+        """Yield the issues matching a filter one at a time. They are
+        fetched pageSize at a time, the next page being requested in the
+        background while the current one is consumed. Issues changing while
+        the filter is walked can be skipped or seen twice."""
+
+        def fetch(offset):
+            future = JiraFuture()
+            def run():
+                try:
+                    future._set(self.jira.getIssuesFromFilterWithLimit(
+                                    self.auth, filterId, offset, pageSize),
+                                None)
+                except Exception, e:
+                    future._set(None, e)
+            t = threading.Thread(target=_withProfiles(_activeProfiles(), run))
+            t.setDaemon(True)
+            t.start()
+            return future
+
+        offset = 0
+        page = fetch(offset)
+        while page:
+            ris = page.result()
+            if not ris:
+                return
+            offset += len(ris)
+            if len(ris) < pageSize:
+                page = None
+            else:
+                page = fetch(offset)
+            for issue in self.wrapIssues(ris, lazy, snapshot):
+                yield issue
+
+    def wrapIssues(self,remoteIssues,lazy=False,snapshot=False):
+        """Wrap RemoteIssues in JiraIssue (lazy or not) or
+        JiraIssueSnapshot objects"""
+        if snapshot:
+            return [ JiraIssueSnapshot(i, self) for i in remoteIssues ]
+        return [ JiraIssue(i, lazy=lazy, jira=self) for i in remoteIssues ]
+
+    def getIssueXml(self,key):
+        """Fetch and parse the XML view of the issue with the given key"""
+        path = ("/si/jira.issueviews:issue-xml/%s/?os_username=%s&"
+                "os_password=%s" % (key,urllib.quote(self.username),
+                                    urllib.quote(self.password)))
+        if self.responseCache is None:
+            f = self.http.open(path)
+            try:
+                return self._parseIssueXml(f)
+            finally:
+                f.close()
+        return JiraIssueXml.fromDict(self.cachedRequest(
+                    'issue-xml', key, path, None,
+                    lambda f: self._parseIssueXml(f).toDict()))
+
+    def _parseIssueXml(self,f):
+        # The body is read from the socket as it is parsed, count the
+        # transfer apart from the parsing itself
+        started = time.time()
+        readTime = f.readTime
+        view = JiraIssueXml(f)
+        readTime = f.readTime - readTime
+        self.instrumentation.add("time", "read:issue-xml", readTime)
+        self.instrumentation.add("time", "parse:issue-xml",
+                                 time.time() - started - readTime)
+        return view
+
+    @contextlib.contextmanager
+    def profile(self):
+        """Collect the remote calls made on this connection while the block
+        runs into a new JiraCallStats:
+
+            with jira.profile() as calls:
+                nightlyJob(jira)
+            print calls.report()
+
+        Only calls made by the thread running the block are counted, along
+        with those of the worker threads it starts (e.g. in getIssues,
+        bulkUpdate or JiraAsync.submit), so other jobs sharing the
+        connection do not show up in the profile. Use addHook on
+        instrumentation to see every call."""
+        calls = JiraCallStats()
+        saved = _activeProfiles()
+        _profiles.active = saved + ((self.instrumentation, calls),)
+        try:
+            yield calls
+        finally:
+            _profiles.active = saved
+
+    def cachedRequest(self,endpoint,key,path,data,parse):
+        """Request path (POSTing data if given) through the response cache.
+        parse turns the response into a JSON-compatible value, which is
+        cached under endpoint and key. A fresh entry is used as it is; a
+        stale one is revalidated with its ETag or Last-Modified date when
+        the server gave one. Entries are kept per server and user, so a
+        cache can be shared by several connections."""
+
+        cacheKey = self._responseCacheKey(endpoint, key)
+        entry = self.responseCache.get(cacheKey)
+        now = time.time()
+        if entry and now - entry['time'] < self.responseTTLs.get(endpoint, 0):
+            return entry['value']
+
+        headers = {}
+        if entry and data is None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('modified'):
+                headers['If-Modified-Since'] = entry['modified']
+        f = self.http.open(path, data, headers, idempotent=True)
+        try:
+            etag = f.getheader('ETag')
+            modified = f.getheader('Last-Modified')
+            if f.status == 304 and entry:
+                value = entry['value']
+                etag = etag or entry.get('etag')
+                modified = modified or entry.get('modified')
+            else:
+                value = parse(f)
+        finally:
+            f.close()
+        self.responseCache.put(cacheKey, {'time': now, 'etag': etag,
+                                          'modified': modified,
+                                          'value': value})
+        return value
+
+    def _responseCacheKey(self,endpoint,key):
+        return "%s|%s|%s:%s" % (self.url.rstrip("/"), self.username,
+                                endpoint, key)
+
+    def invalidateIssueXml(self,key):
+        """Drop the cached XML view of the issue with the given key"""
+        if self.responseCache is not None:
+            self.responseCache.invalidate(self._responseCacheKey('issue-xml',
+                                                                 key))
+
+    def buildLinkGraph(self,rootKeys,depth=None,linkTypes=None,
+                       subtasks=True,maxWorkers=8):
+        """Walk the issue links breadth-first from rootKeys and return a
+        JiraLinkGraph. The XML views of each level are fetched with up to
+        maxWorkers concurrent requests and no issue is fetched twice.
+
+        depth limits the number of steps from the roots (None for no
+        limit). linkTypes, if given, is a list of link type ids or
+        descriptions (e.g. "blocks") to follow; parent and sub-task
+        relations are followed unless subtasks is False. Edges to issues
+        beyond the depth limit are kept, but those issues are not fetched.
+        Issues that cannot be fetched are recorded in the graph's errors."""
+
+        if isinstance(rootKeys, basestring):
+            rootKeys = [rootKeys]
+        if linkTypes is not None:
+            linkTypes = set(linkTypes)
+
+        graph = JiraLinkGraph()
+        seen = set()
+        frontier = []
+        for key in rootKeys:
+            if key not in seen:
+                seen.add(key)
+                frontier.append(key)
+
+        level = 0
+        while frontier:
+            results = _runConcurrently(self.getIssueXml, frontier, maxWorkers)
+            expand = depth is None or level < depth
+            next = []
+            for key, (view, error) in zip(frontier, results):
+                if error:
+                    graph.errors[key] = error
+                    continue
+                neighbours = graph._add(key, view, linkTypes, subtasks)
+                if not expand:
+                    continue
+                for other in neighbours:
+                    if other not in seen:
+                        seen.add(other)
+                        next.append(other)
+            frontier = next
+            level += 1
+        return graph
 
     def getProject(self,projectKey):
         """Check the project exists, if so, return it."""
         try:
             rp = self.jira.getProjectByKey(self.auth,projectKey)
-            return JiraProject(rp, projectKey)
-        except:
-            raise Exception("Project not found")
+        except Types.faultType, e:
+            if _isNotFoundFault(e):
+                raise JiraNotFound("Project not found", e)
+            raise
+        return JiraProject(rp, projectKey, jira=self)
 
     def addVersionToProject(self,projectKey,version):
         """Add a version to a project, given the project key string."""
         rv = self.jira.addVersion(self.auth, projectKey, {'name': version})
+        self.metadata.invalidate(('versions', projectKey))
         return rv['id']
 
     def addFixedVersion(self, versionName, ticket, comment, force=False):
@@ -137,10 +838,73 @@ class Jira:
             issue.addFixedVersion(versionName)
         issue.addComment(comment)
 
-    def getIssuesFromFilterName(self, filterName):
+    # JiraIssue methods that bulkUpdate accepts. Those in FIELD_OPERATIONS
+    # only change fields, so consecutive ones are sent as one update.
+    FIELD_OPERATIONS = ('update', 'setSummary', 'setDescription',
+                        'setEnvironment', 'setPriority', 'setReporter',
+                        'setCustomField', 'addFixedVersion')
+    BULK_OPERATIONS = FIELD_OPERATIONS + ('addComment', 'addSecureComment')
+
+    def bulkUpdate(self, changes, maxWorkers=8, retries=2):
+        """Apply operations to many issues concurrently.
+
+        changes is a list of (key, operations) pairs, where each operation is
+        a tuple of a JiraIssue method name from BULK_OPERATIONS and its
+        arguments, e.g. ('addComment', 'Fixed in trunk') or
+        ('addFixedVersion', '6.2'). Issues are fetched only if an operation
+        needs their fields. A step of field operations that fails with a
+        transient error is retried up to retries times, without repeating
+        the steps before it; it sets absolute values, so it is safe to send
+        again. Comments are not retried, as the server may have added the
+        comment before the error.
+        Returns a list of JiraResult in the order of changes, with the
+        JiraIssue as the value of each success."""
+
+        for key, operations in changes:
+            for op in operations:
+                if op[0] not in self.BULK_OPERATIONS:
+                    raise Exception("Unsupported bulk operation %s" % (op[0]))
+
+        def apply(change):
+            key, operations = change
+            issue = JiraIssue(key=key, lazy=True, jira=self)
+
+            # Group consecutive field operations into a single step
+            steps = []
+            for op in operations:
+                if op[0] in self.FIELD_OPERATIONS and steps and \
+                   steps[-1][0][0] in self.FIELD_OPERATIONS:
+                    steps[-1].append(op)
+                else:
+                    steps.append([op])
+
+            for step in steps:
+                attempt = 0
+                while True:
+                    try:
+                        with issue.batch():
+                            for op in step:
+                                getattr(issue, op[0])(*op[1:])
+                        break
+                    except _TRANSIENT_ERRORS:
+                        if attempt >= retries or \
+                           step[0][0] not in self.FIELD_OPERATIONS:
+                            raise
+                        time.sleep(0.5 * 2 ** attempt)
+                        attempt += 1
+                        # The failed step may have changed fields locally,
+                        # so start again from the server's copy
+                        issue = JiraIssue(key=key, lazy=True, jira=self)
+            return issue
+
+        results = _runConcurrently(apply, changes, maxWorkers)
+        return [ JiraResult(key, issue, error) for (key, operations),
+                 (issue, error) in zip(changes, results) ]
+
+    def getIssuesFromFilterName(self, filterName, lazy=False, snapshot=False):
         """Given a filter name, return a list of JiraIssue objects that match"""
         filter = self.getFilter(filterName)
-        issues = filter.getIssues()
+        issues = filter.getIssues(lazy, snapshot)
 
         return issues
 
@@ -148,9 +912,12 @@ class Jira:
         """Check the group exists, if so, return it."""
         try:
             rg = self.jira.getGroup(self.auth, groupName)
-            return JiraGroup(rg, groupName)
-        except:
-            raise Exception("Group not found")
+        except Types.faultType, e:
+            if _isNotFoundFault(e):
+                raise JiraNotFound("Group not found", e)
+            raise
+        self.users.warm(rg.users)
+        return JiraGroup(rg, groupName, jira=self)
 
     def getGroupUsers(self, groupName):
         """Return the users of the group with passed name."""
@@ -162,39 +929,1039 @@ class Jira:
         remoteFilters = self.jira.getSavedFilters(self.auth)
         retFilters = []
         for filter in remoteFilters:
-            retFilters.append(JiraFilter(filter))
+            retFilters.append(JiraFilter(filter, jira=self))
+        self.metadata.setFilters(retFilters)
         return retFilters
 
     def getFilter(self, filterName):
-        """Return filter object for filter with passed name"""
-        filters = self.getSavedFilters()
-        retfilter = None
-        for filter in filters:
-            if filter.getName() == filterName:
-                retfilter = filter
-                break
-        if retfilter == None:
-            raise Exception("Filter not found")
-        return retfilter
+        """Return filter object for filter with passed name. Filters are
+        looked up in the metadata cache, which is reloaded once if the name
+        is not found there."""
+        filters = self.metadata.getFilters()
+        if not filters.has_key(filterName):
+            self.refreshFilters()
+            filters = self.metadata.getFilters()
+            if not filters.has_key(filterName):
+                raise JiraNotFound("Filter not found")
+        return filters[filterName]
+
+    def refreshFilters(self):
+        """Discard the cached list of saved filters"""
+        self.metadata.invalidate('filters')
 
     def getFilterUrl(self, filterName):
         """Return a Url for the named filter"""
         filter = self.getFilter(filterName)
         return filter.getUrl()
 
-class JiraObject:
+def _operationName(endpoint):
+    """The operation a scheduler endpoint is counted under: SOAP method
+    names as they are, and servlet paths up to the first issue key or
+    numeric id, so that e.g. all issue XML requests are counted together"""
+    if not endpoint.startswith("/"):
+        return endpoint
+    parts = []
+    for part in endpoint.split("/"):
+        if part.isdigit() or _ISSUE_KEY.match(part):
+            break
+        parts.append(part)
+    return "/".join(parts).rstrip("/") or "/"
+
+_ISSUE_KEY = re.compile(r"^[A-Z][A-Z0-9_]*-[0-9]+$")
+
+class JiraCallStats:
+    """Counters and latency histograms of remote calls, by operation.
+
+    Events are (metric, operation, value) triples, where metric is one of
+    "time" (a call, or parsing, took value seconds), "error", "retry",
+    "throttle" (value seconds waited for the rate limit) and "bytes" (value
+    bytes sent and received by a servlet request). Operations are SOAP
+    method names, servlet paths (see _operationName), "parse:" followed
+    by the view parsed and "read:" followed by the view whose body was
+    received while parsing it."""
+
+    # Upper bounds, in seconds, of the latency histogram buckets; a last
+    # bucket counts the slower calls
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
 
     def __init__(self):
-        global _jira
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def add(self, metric, operation, value):
+        with self.lock:
+            op = self.operations.get(operation)
+            if op is None:
+                op = self.operations[operation] = {
+                    'count': 0, 'errors': 0, 'retries': 0, 'time': 0.0,
+                    'throttled': 0.0, 'bytes': 0,
+                    'histogram': [0] * (len(self.BUCKETS) + 1)}
+            if metric == "time":
+                op['count'] += 1
+                op['time'] += value
+                op['histogram'][bisect.bisect_left(self.BUCKETS, value)] += 1
+            elif metric == "error":
+                op['errors'] += value
+            elif metric == "retry":
+                op['retries'] += value
+            elif metric == "throttle":
+                op['throttled'] += value
+            elif metric == "bytes":
+                op['bytes'] += value
+
+    def getStats(self):
+        """Return a dictionary of operation:counters, the histogram being a
+        list of (upper bound, calls) pairs with None as the last bound"""
+        bounds = list(self.BUCKETS) + [None]
+        with self.lock:
+            stats = {}
+            for operation, op in self.operations.items():
+                op = dict(op)
+                op['histogram'] = zip(bounds, op['histogram'])
+                stats[operation] = op
+            return stats
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+    def report(self):
+        """Return a table of the operations, slowest in total first"""
+        stats = self.getStats().items()
+        stats.sort(key=lambda item: -item[1]['time'])
+        lines = ["%-50s %7s %6s %10s %9s %11s" % ("operation", "calls",
+                 "errors", "total ms", "mean ms", "bytes")]
+        for operation, op in stats:
+            mean = op['count'] and op['time'] / op['count']
+            lines.append("%-50s %7d %6d %10.1f %9.1f %11d" %
+                         (operation, op['count'], op['errors'],
+                          op['time'] * 1000, mean * 1000, op['bytes']))
+        return "\n".join(lines)
+
+class JiraInstrumentation(JiraCallStats):
+    """The call statistics of a Jira connection (Jira.instrumentation).
+
+    Hooks added with addHook are called as hook(metric, operation, value)
+    for every event, e.g. to forward them to statsd or Prometheus; they
+    may be called from several threads at once, and exceptions they raise
+    are ignored."""
 
-        self.Jira = _jira
-        self.jira = _jira.jira
-        self.auth = _jira.auth
+    def __init__(self):
+        JiraCallStats.__init__(self)
+        self.hooks = []
+
+    def addHook(self, hook):
+        with self.lock:
+            self.hooks = self.hooks + [hook]
+
+    def removeHook(self, hook):
+        with self.lock:
+            hooks = list(self.hooks)
+            hooks.remove(hook)
+            self.hooks = hooks
+
+    def add(self, metric, operation, value):
+        operation = _operationName(operation)
+        JiraCallStats.add(self, metric, operation, value)
+        for hook in self.hooks:
+            try:
+                hook(metric, operation, value)
+            except Exception:
+                pass
+        for instrumentation, calls in _activeProfiles():
+            if instrumentation is self:
+                calls.add(metric, operation, value)
+
+class JiraRateLimiter:
+    """Token bucket allowing rate calls per second on average and bursts of
+    up to burst calls"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if necessary. Returns the number
+        of seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+class JiraScheduler:
+    """Runs every remote call of a Jira connection, applying per-endpoint
+    timeouts, rate limiting and retries.
+
+    Endpoints are SOAP method names (e.g. "getIssue") and servlet paths
+    without the query string. timeouts maps endpoints to seconds, keys
+    starting with "/" matching any path they are a prefix of; others use
+    timeout. Idempotent calls failing with a transient error are retried up
+    to retries times after a random delay of up to backoff * 2**attempt
+    seconds (capped at maxBackoff). If rate is given, calls are limited to
+    rate per second with bursts of up to burst, over all threads.
+
+    Once a transient error is not retried, it is raised as a
+    JiraTransientError with the original error as cause. Other errors, such
+    as SOAP faults, are raised as they are."""
+
+    def __init__(self, retries=3, backoff=0.5, maxBackoff=30, rate=None,
+                 burst=None, timeout=60, timeouts=None, instrumentation=None):
+        self.retries = retries
+        self.instrumentation = instrumentation
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        if rate:
+            self.limiter = JiraRateLimiter(rate, burst)
+        else:
+            self.limiter = None
+        self.lock = threading.Lock()
+
+        # Counters
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+        self.throttled = 0.0
+
+    def getTimeout(self, endpoint):
+        """Return the timeout in seconds for endpoint"""
+        if self.timeouts.has_key(endpoint):
+            return self.timeouts[endpoint]
+        best = None
+        for prefix in self.timeouts:
+            if prefix.startswith("/") and endpoint.startswith(prefix) and \
+               (best is None or len(prefix) > len(best)):
+                best = prefix
+        if best is None:
+            return self.timeout
+        return self.timeouts[best]
+
+    def isTransient(self, error):
+        """Whether error may not happen if the call is made again"""
+        if isinstance(error, _TRANSIENT_ERRORS):
+            return True
+        if isinstance(error, SOAPpy.HTTPError):
+            return error.code in _TRANSIENT_STATUSES
+        if isinstance(error, JiraHTTPError):
+            return error.status in _TRANSIENT_STATUSES
+        return False
+
+    def call(self, endpoint, func, idempotent=False):
+        """Return func(timeout) for a call to endpoint, retrying it if it
+        is idempotent"""
+
+        timeout = self.getTimeout(endpoint)
+        attempt = 0
+        while True:
+            if self.limiter:
+                waited = self.limiter.acquire()
+            else:
+                waited = 0.0
+            with self.lock:
+                self.calls += 1
+                self.throttled += waited
+            instrumentation = self.instrumentation
+            if instrumentation and waited:
+                instrumentation.add("throttle", endpoint, waited)
+            started = time.time()
+            try:
+                value = func(timeout)
+                if instrumentation:
+                    instrumentation.add("time", endpoint,
+                                        time.time() - started)
+                return value
+            except Exception, e:
+                if instrumentation:
+                    instrumentation.add("time", endpoint,
+                                        time.time() - started)
+                    instrumentation.add("error", endpoint, 1)
+                if not self.isTransient(e):
+                    raise
+                if not idempotent or attempt >= self.retries:
+                    with self.lock:
+                        self.failures += 1
+                    if isinstance(e, JiraTransientError):
+                        raise
+                    raise JiraTransientError("%s failed after %d attempt(s): "
+                                             "%s" % (endpoint, attempt + 1, e),
+                                             e)
+            time.sleep(random.uniform(0, min(self.maxBackoff,
+                                             self.backoff * 2 ** attempt)))
+            attempt += 1
+            with self.lock:
+                self.retried += 1
+            if instrumentation:
+                instrumentation.add("retry", endpoint, 1)
+
+    def getStats(self):
+        """Return a dictionary of counters: calls (including retries),
+        retries, failures, and seconds spent waiting for the rate limit"""
+        with self.lock:
+            return {'calls': self.calls, 'retries': self.retried,
+                    'failures': self.failures, 'throttled': self.throttled}
+
+class JiraSoapClient:
+    """Thread-safe front end to the JIRA SOAP service.
+
+    SOAPpy's WSDL proxy sets up the method's address and namespace on one
+    shared SOAPProxy before every call, so concurrent calls can interfere.
+    Here the WSDL is parsed once and each thread calls through its own
+    SOAPProxy. The login token itself can be shared between threads.
+
+    Calls go through scheduler, the method name being the endpoint. Methods
+    that only read (get*) and login are retried on transient errors."""
+
+    def __init__(self, wsdl, scheduler=None):
+        self.wsdl = wsdl
+        self.scheduler = scheduler or JiraScheduler()
+        self.local = threading.local()
+
+    def _newProxy(self):
+        return SOAPpy.SOAPProxy("http://localhost/dummy.webservice",
+                                config=self.wsdl.soapproxy.config)
+
+    def hasMethod(self, name):
+        """Whether the server's WSDL has the named method"""
+        return self.wsdl.methods.has_key(name)
+
+    def _proxy(self, name):
+        proxy = getattr(self.local, "proxy", None)
+        if proxy is None:
+            proxy = self.local.proxy = self._newProxy()
+        callinfo = self.wsdl.methods[name]
+        proxy.proxy = SOAPpy.Client.SOAPAddress(callinfo.location)
+        proxy.namespace = callinfo.namespace
+        proxy.soapaction = callinfo.soapAction
+        return proxy
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not self.wsdl.methods.has_key(name):
+            raise AttributeError(name)
+
+        def call(*args, **kw):
+            def attempt(timeout):
+                proxy = self._proxy(name)
+                proxy.timeout = timeout
+                return getattr(proxy, name)(*args, **kw)
+            idempotent = name.startswith("get") or name == "login"
+            return self.scheduler.call(name, attempt, idempotent)
+        return call
+
+class JiraMetadataCache:
+    """Per-connection cache of priorities, custom field name->id maps,
+    project versions and saved filters.
+
+    Entries expire after ttl seconds (None means never). Each entry is
+    loaded by one thread at a time, others needing it wait for the result."""
+
+    def __init__(self, jira, ttl=3600):
+        self.Jira = jira
+        self.ttl = ttl
+        self.entries = {}
+        # name:threading.Event for the entries being loaded
+        self.loading = {}
+        self.lock = threading.RLock()
+
+    def _lookup(self, name, load):
+        while True:
+            with self.lock:
+                entry = self.entries.get(name)
+                if entry:
+                    if self.ttl is None or time.time() - entry[0] < self.ttl:
+                        return entry[1]
+                    del self.entries[name]
+                event = self.loading.get(name)
+                if event is None:
+                    event = self.loading[name] = threading.Event()
+                    break
+            # Another thread is loading it; if that fails, try again here
+            event.wait()
+
+        try:
+            value = load()
+            self._store(name, value)
+        finally:
+            with self.lock:
+                del self.loading[name]
+            event.set()
+        return value
+
+    def _store(self, name, value):
+        with self.lock:
+            self.entries[name] = (time.time(), value)
+
+    def refresh(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+    def setPriorities(self, index):
+        """Seed the priorities from a JiraNameIndex"""
+        self._store('priorities', index.byName())
+
+    def getPriorities(self):
+        """Returns a dictionary of priority name:id"""
+
+        def load():
+            priorities = {}
+            for prio in self.Jira.jira.getPriorities(self.Jira.auth):
+                priorities[prio['name']] = prio['id']
+            return priorities
+        return self._lookup('priorities', load)
+
+    def getCustomFields(self, project, type, key):
+        """Returns a dictionary of custom field name:id for issues of the
+        given project and type, using issue key to look them up if needed"""
+
+        def load():
+            customFields = {}
+            for f in self.Jira.jira.getFieldsForEdit(self.Jira.auth, key):
+                if f['id'].startswith("customfield_"):
+                    customFields[f['name']] = f['id']
+            return customFields
+        return self._lookup(('customFields', project, type), load)
+
+    def getCreateCustomFields(self, project, type):
+        """Returns a dictionary of custom field name:id of the fields that
+        can be set when creating issues of the given project and type. The
+        create screen may differ from the edit screen, so this is kept apart
+        from getCustomFields."""
+
+        def load():
+            customFields = {}
+            for f in self.Jira.jira.getFieldsForCreate(self.Jira.auth,
+                                                       project, long(type)):
+                if f['id'].startswith("customfield_"):
+                    customFields[f['name']] = f['id']
+            return customFields
+        return self._lookup(('createFields', project, type), load)
+
+    def setFilters(self, filters):
+        """Index a list of JiraFilters by name, the first of several
+        filters with the same name winning"""
+        index = {}
+        for filter in filters:
+            index.setdefault(filter.getName(), filter)
+        self._store('filters', index)
+        return index
+
+    def getFilters(self):
+        """Returns a dictionary of filter name:JiraFilter"""
+
+        def load():
+            return self.setFilters(self.Jira.getSavedFilters())
+        return self._lookup('filters', load)
+
+    def setCustomFields(self, project, type, customFields):
+        """Seed the custom field name:id map for a project and issue type"""
+        self._store(('customFields', project, type), customFields)
+
+    def getVersions(self, project):
+        """Returns a dictionary of version name:id for the project"""
+
+        def load():
+            versions = {}
+            for v in self.Jira.jira.getVersions(self.Jira.auth, project):
+                versions[v['name']] = v['id']
+            return versions
+        return self._lookup(('versions', project), load)
+
+    def getVersionId(self, project, name):
+        """Returns the id of the named version, reloading the project's
+        versions once if it is not known"""
+
+        versions = self.getVersions(project)
+        if not versions.has_key(name):
+            self.invalidate(('versions', project))
+            versions = self.getVersions(project)
+            if not versions.has_key(name):
+                raise JiraNotFound("Version %s not found in %s" %
+                                   (name, project))
+        return versions[name]
+
+class JiraUserDirectory:
+    """Per-connection cache of user profiles, as dictionaries of name,
+    fullname and email, by username.
+
+    At most maxUsers profiles are kept, the least recently used being
+    dropped first, and each expires after ttl seconds (None means never).
+    Users that do not exist are remembered too. Groups fetched with
+    Jira.getGroup add all their users."""
+
+    def __init__(self, jira, ttl=3600, maxUsers=5000):
+        self.Jira = jira
+        self.ttl = ttl
+        self.maxUsers = maxUsers
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _lookup(self, username):
+        """Returns (found, profile) from the cache"""
+        with self.lock:
+            entry = self.entries.pop(username, None)
+            if entry is None:
+                return False, None
+            if self.ttl is not None and time.time() - entry[0] >= self.ttl:
+                return False, None
+            self.entries[username] = entry
+            return True, entry[1]
+
+    def _store(self, username, profile):
+        with self.lock:
+            self.entries.pop(username, None)
+            self.entries[username] = (time.time(), profile)
+            while len(self.entries) > self.maxUsers:
+                self.entries.popitem(last=False)
+
+    def _fetch(self, username):
+        user = self.Jira.jira.getUser(self.Jira.auth, username)
+        if user is None:
+            profile = None
+        else:
+            profile = self._profile(user)
+        self._store(username, profile)
+        return profile
+
+    def _profile(self, user):
+        return {'name': _intern(str(user['name'])),
+                'fullname': user['fullname'], 'email': user['email']}
+
+    def warm(self, remoteUsers):
+        """Add profiles from RemoteUsers, e.g. the users of a RemoteGroup"""
+        for user in remoteUsers or []:
+            profile = self._profile(user)
+            self._store(profile['name'], profile)
+
+    def get(self, username):
+        """Return the profile of username, or None if there is no such user"""
+        found, profile = self._lookup(username)
+        if found:
+            return profile
+        return self._fetch(username)
+
+    def getMany(self, usernames, maxWorkers=8):
+        """Return a dictionary of username:profile (None for unknown users)
+        for usernames, fetching those not cached with up to maxWorkers
+        concurrent requests"""
+        profiles = {}
+        misses = []
+        for username in usernames:
+            if profiles.has_key(username):
+                continue
+            found, profile = self._lookup(username)
+            if found:
+                profiles[username] = profile
+            else:
+                profiles[username] = None
+                misses.append(username)
+        for username, (profile, error) in zip(misses,
+                _runConcurrently(self._fetch, misses, maxWorkers)):
+            if error:
+                raise error
+            profiles[username] = profile
+        return profiles
+
+    def invalidate(self, username=None):
+        """Forget one user's profile, or all of them"""
+        with self.lock:
+            if username is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(username, None)
+
+class JiraHTTPResponse:
+    """A response from JiraHTTPPool.open. Closing it hands the connection
+    back to the pool when it can be reused."""
+
+    # Unread bodies up to this size are drained rather than dropping the
+    # connection
+    DRAIN_LIMIT = 65536
+
+    def __init__(self, pool, conn, response, endpoint=None, sent=0):
+        self.pool = pool
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.endpoint = endpoint
+        # Bytes of request and response bodies, and seconds spent reading
+        # the response body, for instrumentation
+        self.bytes = sent
+        self.readTime = 0.0
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        started = time.time()
+        data = self.response.read(amt)
+        self.readTime += time.time() - started
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        if self.conn is None:
+            return
+        conn = self.conn
+        self.conn = None
+        response = self.response
+        reusable = not response.will_close
+        if reusable and not response.isclosed():
+            if response.length is not None and \
+               response.length <= self.DRAIN_LIMIT:
+                try:
+                    self.bytes += len(response.read())
+                except (httplib.HTTPException, socket.error):
+                    reusable = False
+            else:
+                reusable = False
+        self.pool._release(conn, reusable)
+        if self.pool.instrumentation and self.endpoint:
+            self.pool.instrumentation.add("bytes", self.endpoint, self.bytes)
+
+class JiraHTTPPool:
+    """A bounded pool of keep-alive connections to the JIRA server, used for
+    the servlet and JSP requests that SOAP does not cover. Requests go
+    through scheduler, with the path as the endpoint."""
+
+    # Redirects followed by a GET before giving up
+    MAX_REDIRECTS = 5
+
+    def __init__(self, url, size=4, timeout=60, scheduler=None,
+                 instrumentation=None):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.size = size
+        self.timeout = timeout
+        self.scheduler = scheduler or JiraScheduler(timeout=timeout)
+        self.instrumentation = instrumentation
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(size)
+
+        # Counters
+        self.requests = 0
+        self.connections = 0
+        self.reuses = 0
+
+    def _connect(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        if self.scheme == "https":
+            conn = httplib.HTTPSConnection(self.host, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(self.host, timeout=timeout)
+        with self.lock:
+            self.connections += 1
+        return conn
+
+    def _acquire(self, timeout):
+        self.slots.acquire()
+        with self.lock:
+            if self.idle:
+                self.reuses += 1
+                conn = self.idle.pop()
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+        return self._connect(timeout), False
+
+    def _release(self, conn, reusable):
+        if reusable:
+            with self.lock:
+                self.idle.append(conn)
+        else:
+            conn.close()
+        self.slots.release()
+
+    def open(self, path, data=None, headers=None, idempotent=None):
+        """Request path (relative to the JIRA URL), POSTing data if given.
+        Returns a JiraHTTPResponse, which must be closed after use.
+
+        JSP actions (.jspa), such as DeleteLink.jspa, change state even
+        when requested with a GET. The request is retried on transient
+        errors if idempotent, which defaults to whether it is a GET other
+        than an action. Otherwise it is sent once: a pooled connection that
+        the server has closed is replaced only for idempotent requests.
+        GETs other than actions (whose redirect is their normal answer)
+        follow redirects within the JIRA URL; a redirect elsewhere, e.g. to
+        https or a login server, raises JiraHTTPError."""
+
+        headers = dict(headers or {})
+        if data is None:
+            method = "GET"
+        else:
+            method = "POST"
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        action = path.split("?")[0].endswith(".jspa")
+        if idempotent is None:
+            idempotent = data is None and not action
+
+        for redirect in range(self.MAX_REDIRECTS + 1):
+            r = self.scheduler.call(path.split("?")[0],
+                                    lambda timeout: self._open(method, path,
+                                                               data, headers,
+                                                               timeout,
+                                                               idempotent),
+                                    idempotent)
+            if method != "GET" or action or r.status < 300 or \
+               r.status >= 400 or r.status == 304:
+                return r
+            location = r.getheader("Location")
+            r.close()
+            path = self._redirectPath(path, r.status, location)
+        raise JiraHTTPError("Too many redirects for %s" % (path.split("?")[0]),
+                            r.status)
+
+    def _redirectPath(self, path, status, location):
+        """The path to request for a redirect from path to location, if
+        it stays within the JIRA URL"""
+        base = "%s://%s%s" % (self.scheme, self.host, self.prefix + path)
+        parts = urlparse.urlsplit(urlparse.urljoin(base, location or ""))
+        if not location or parts.scheme != self.scheme or \
+           parts.netloc != self.host or \
+           not parts.path.startswith(self.prefix + "/"):
+            raise JiraHTTPError("HTTP %d redirect from %s to %s" %
+                                (status, path.split("?")[0], location), status)
+        path = parts.path[len(self.prefix):]
+        if parts.query:
+            path += "?" + parts.query
+        return path
+
+    def _open(self, method, path, data, headers, timeout, idempotent):
+        with self.lock:
+            self.requests += 1
+
+        conn, reused = self._acquire(timeout)
+        try:
+            try:
+                conn.request(method, self.prefix + path, data, headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                # Other errors, timeouts and writes are left to the scheduler
+                if not (reused and idempotent and _isStaleConnection(e)):
+                    raise
+                # The server closed an idle connection, try a fresh one
+                conn.close()
+                conn = self._connect(timeout)
+                conn.request(method, self.prefix + path, data, headers)
+                response = conn.getresponse()
+        except:
+            conn.close()
+            self.slots.release()
+            raise
+
+        r = JiraHTTPResponse(self, conn, response, path.split("?")[0],
+                             len(data or ""))
+        if r.status >= 400:
+            r.close()
+            raise JiraHTTPError("HTTP error %d (%s) for %s" %
+                                (r.status, response.reason,
+                                 path.split("?")[0]), r.status)
+        return r
+
+    def request(self, path, data=None):
+        """As open, but returns the whole response body"""
+
+        r = self.open(path, data)
+        try:
+            return r.read()
+        finally:
+            r.close()
+
+    def download(self, path, filename, chunkSize=1048576):
+        """Stream the response body for path into filename, chunkSize bytes
+        at a time. The file is written under a temporary name and renamed
+        when complete, so filename never holds a partial download."""
+
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                       prefix=".jira-")
+        try:
+            f = os.fdopen(fd, "wb")
+            try:
+                r = self.open(path)
+                try:
+                    while True:
+                        data = r.read(chunkSize)
+                        if not data:
+                            break
+                        f.write(data)
+                finally:
+                    r.close()
+            finally:
+                f.close()
+            os.chmod(tmpname, 0644)
+            os.rename(tmpname, filename)
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def getStats(self):
+        """Returns a dictionary of request, connection and reuse counts"""
+
+        with self.lock:
+            return {'requests': self.requests,
+                    'connections': self.connections,
+                    'reuses': self.reuses}
+
+class JiraLinkGraph:
+    """The issues reached by Jira.buildLinkGraph and the edges between
+    them, as adjacency lists keyed by issue key. Keys and descriptions are
+    interned, so large graphs share their strings."""
+
+    def __init__(self):
+        # key:issue id for each issue fetched
+        self.nodes = {}
+        # key:list of (key, link description, link type id) tuples
+        self.links = {}
+        # key:parent key, for sub-tasks
+        self.parents = {}
+        # key:list of sub-task keys
+        self.subtasks = {}
+        # key:exception for issues that could not be fetched
+        self.errors = {}
+
+    def _add(self, key, view, linkTypes, subtasks):
+        """Record the issue with the given JiraIssueXml view and return the
+        keys of the neighbours to follow"""
+
+        key = _intern(key)
+        self.nodes[key] = view.id
+        links = []
+        for linktype, desc, other, id in view.links:
+            if linkTypes is not None and linktype not in linkTypes and \
+               desc not in linkTypes:
+                continue
+            links.append((_intern(other), _intern(desc), _intern(linktype)))
+        self.links[key] = links
+        neighbours = [ other for other, desc, linktype in links ]
+        if subtasks:
+            if view.parents:
+                self.parents[key] = _intern(view.parents[0])
+                neighbours.extend(view.parents)
+            if view.subtasks:
+                self.subtasks[key] = [ _intern(k) for k in view.subtasks ]
+                neighbours.extend(view.subtasks)
+        return neighbours
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, key):
+        return key in self.nodes
+
+    def keys(self):
+        return self.nodes.keys()
+
+    def getLinks(self, key):
+        """Returns a dictionary of issue:linktype, as JiraIssue.getLinks"""
+        return dict([ (other, desc) for other, desc, linktype
+                      in self.links.get(key, []) ])
+
+    def getParent(self, key):
+        return self.parents.get(key)
+
+    def getChildren(self, key):
+        return list(self.subtasks.get(key, []))
+
+    def edges(self):
+        """Yield (from key, to key, description) for every edge; parent
+        and sub-task edges are described as parent and subtask"""
+        for key, links in self.links.iteritems():
+            for other, desc, linktype in links:
+                yield key, other, desc
+        for key, parent in self.parents.iteritems():
+            yield key, parent, "parent"
+        for key, children in self.subtasks.iteritems():
+            for child in children:
+                yield key, child, "subtask"
+
+class JiraResponseCache:
+    """In-memory LRU cache of servlet responses for Jira(responseCache=...).
+
+    Entries are dictionaries of JSON-compatible values. The least recently
+    used are evicted once their total JSON size exceeds maxBytes. An
+    optional backend such as JiraDiskResponseCache is consulted on misses
+    and written through, so that several processes can share entries."""
+
+    def __init__(self, maxBytes=16*1024*1024, backend=None):
+        self.maxBytes = maxBytes
+        self.backend = backend
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def _remember(self, key, entry, size):
+        with self.lock:
+            if self.entries.has_key(key):
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (entry, size)
+            self.size += size
+            while self.size > self.maxBytes and self.entries:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.pop(key, None)
+            if item:
+                self.entries[key] = item
+                return item[0]
+        if self.backend:
+            entry = self.backend.get(key)
+            if entry:
+                self._remember(key, entry, len(json.dumps(entry)))
+            return entry
+        return None
+
+    def put(self, key, entry):
+        data = json.dumps(entry)
+        self._remember(key, entry, len(data))
+        if self.backend:
+            self.backend.put(key, entry)
+
+    def invalidate(self, key):
+        with self.lock:
+            item = self.entries.pop(key, None)
+            if item:
+                self.size -= item[1]
+        if self.backend:
+            self.backend.invalidate(key)
+
+class JiraDiskResponseCache:
+    """Response cache entries stored as JSON files in a directory, which
+    can be shared between processes. Usually the backend of a
+    JiraResponseCache."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + ".json")
+
+    def get(self, key):
+        try:
+            f = file(self._path(key))
+        except IOError:
+            return None
+        try:
+            try:
+                return json.load(f)
+            except ValueError:
+                return None
+        finally:
+            f.close()
+
+    def put(self, key, entry):
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, prefix=".jira-")
+        try:
+            f = os.fdopen(fd, "w")
+            try:
+                json.dump(entry, f)
+            finally:
+                f.close()
+            os.rename(tmpname, self._path(key))
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def invalidate(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+class JiraIssueXml:
+    """The links, parent and sub-tasks of an issue, parsed from its XML view.
+
+    The XML is read incrementally from a file-like object, everything else
+    (description, comments, ...) is discarded as it is parsed, and reading
+    stops once the custom fields are reached as nothing after them is used."""
+
+    def __init__(self, stream=None):
+        # The id of the issue itself
+        self.id = None
+        # (link type id, link description, issue key, issue id) tuples
+        self.links = []
+        self.parents = []
+        self.subtasks = []
+        if stream is None:
+            return
+
+        linktype = None
+        desc = None
+        for event, elem in ElementTree.iterparse(stream, ("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == "issuelinktype":
+                    linktype = elem.get("id")
+                elif tag == "outwardlinks" or tag == "inwardlinks":
+                    desc = elem.get("description")
+                elif tag == "customfields":
+                    break
+                continue
+            if tag == "issuekey":
+                self.links.append((linktype, desc, elem.text, elem.get("id")))
+            elif tag == "parent":
+                self.parents.append(elem.text)
+            elif tag == "subtask":
+                self.subtasks.append(elem.text)
+            elif tag == "key" and self.id is None:
+                self.id = elem.get("id")
+            elif tag == "item":
+                break
+            elem.clear()
+
+    def toDict(self):
+        return {'id': self.id, 'links': self.links, 'parents': self.parents,
+                'subtasks': self.subtasks}
+
+    @staticmethod
+    def fromDict(d):
+        view = JiraIssueXml()
+        view.id = d['id']
+        view.links = [ tuple(link) for link in d['links'] ]
+        view.parents = list(d['parents'])
+        view.subtasks = list(d['subtasks'])
+        return view
+
+class JiraObject:
+
+    def __init__(self, jira=None):
+        """Bind the object to the Jira connection that owns it. Objects
+        created by this module always pass it; the default of the most
+        recently created connection is only kept for older callers."""
+        if jira is None:
+            jira = _jira
+
+        self.Jira = jira
+        self.jira = jira.jira
+        self.auth = jira.auth
 
 class JiraProject(JiraObject):
 
-    def __init__(self,RemoteProject,projectKey):
-        JiraObject.__init__(self)
+    def __init__(self,RemoteProject,projectKey,jira=None):
+        JiraObject.__init__(self, jira)
 
         self.RemoteProject = RemoteProject
         self.projectKey = projectKey
@@ -208,15 +1975,16 @@ class JiraProject(JiraObject):
 
     def addVersion(self,version):
         self.jira.addVersion(self.auth, self.key, {'name': version})
+        self.Jira.metadata.invalidate(('versions', self.key))
 
     def getComponents(self):
         comps = self.jira.getComponents(self.auth, self.projectKey)
-        return [ JiraComponent(c) for c in comps ]
+        return [ JiraComponent(c, jira=self.Jira) for c in comps ]
 
 class JiraComponent(JiraObject):
 
-    def __init__(self,RemoteComponent):
-        JiraObject.__init__(self)
+    def __init__(self,RemoteComponent,jira=None):
+        JiraObject.__init__(self, jira)
 
         for k,v in RemoteComponent.__dict__.items():
             self.__dict__[k] = v
@@ -226,8 +1994,20 @@ class JiraComponent(JiraObject):
 
 class JiraIssue(JiraObject):
 
-    def __init__(self,RemoteIssue):
-        JiraObject.__init__(self)
+    def __init__(self,RemoteIssue=None,key=None,lazy=False,jira=None):
+        JiraObject.__init__(self, jira)
+
+        if lazy:
+            # Only the key and id are set up front, other fields are copied
+            # from the RemoteIssue (fetching it if needed) on first access
+            self._lazy = True
+            if RemoteIssue is None:
+                self.key = key
+            else:
+                self.RemoteIssue = RemoteIssue
+                self.key = RemoteIssue.key
+                self.id = RemoteIssue.id
+            return
 
         self.RemoteIssue = RemoteIssue
 
@@ -235,19 +2015,23 @@ class JiraIssue(JiraObject):
         for k,v in RemoteIssue.__dict__.items():
             self.__dict__[k] = v
 
-        # Get priorities
-        prios = self.jira.getPriorities(self.auth)
-        # Parse them
-        self.priorities = {}
-        for prio in prios:
-            self.priorities[prio['name']] = prio['id']
-
-        # Get custom fields
-        fs = self.jira.getFieldsForEdit(self.auth,self.key)
-        self.customFields = {}
-        for f in fs:
-            if f['id'].startswith("customfield_"):
-                self.customFields[f['name']] = f['id']
+    def __getattr__(self, name):
+        # Priorities and custom field ids come from the connection's cache
+        if name == 'priorities':
+            return self.Jira.metadata.getPriorities()
+        if name == 'customFields':
+            return self.Jira.metadata.getCustomFields(self.project, self.type,
+                                                      self.key)
+        if self.__dict__.get('_lazy') and not name.startswith('_'):
+            if name == 'RemoteIssue':
+                self.RemoteIssue = self.Jira.getRemoteIssue(self.key)
+                return self.RemoteIssue
+            fields = self.RemoteIssue.__dict__
+            if fields.has_key(name):
+                self.__dict__[name] = fields[name]
+                self.Jira.countFieldLoad(name)
+                return fields[name]
+        raise AttributeError(name)
 
     def __cmp__(self, other):
         return cmp(int(self.priority), int(other.priority))
@@ -258,13 +2042,13 @@ class JiraIssue(JiraObject):
         return self.created
 
     def getStatus(self):
-        return self.Jira.STATUS[self.status]
+        return self.Jira.registry.statuses.name(self.status)
 
     def getResolution(self):
         if self.resolution == None:
             return None
         else:
-            return self.Jira.RESOLUTION[self.resolution]
+            return self.Jira.registry.resolutions.name(self.resolution)
 
     def getSummary(self):
         return self.summary
@@ -291,24 +2075,31 @@ class JiraIssue(JiraObject):
         return self.priority
 
     def getType(self):
-        return self.Jira.TYPES[self.type]
+        return self.Jira.registry.types.name(self.type)
 
     def getOriginalEstimate(self):
-        u = "%s/plugins/servlet/xenrt/issue_getoriginalestimate" % self.Jira.url
         params = urllib.urlencode({"os_username": self.Jira.username,
                                    "os_password": self.Jira.password,
                                    "issue": self.key})
-        f = urllib2.urlopen(u, params)
-        data = f.read().strip()
-        f.close()
-
-        # data should be an integer:
-        try:
-            estimate = int(data)
-        except:
-            raise RuntimeError, "Error retrieving original estimate: got %s" % data
-
-        return estimate
+        path = "/plugins/servlet/xenrt/issue_getoriginalestimate"
+
+        def parse(f):
+            data = f.read().strip()
+
+            # data should be an integer:
+            try:
+                return int(data)
+            except:
+                raise RuntimeError, "Error retrieving original estimate: got %s" % data
+
+        if self.Jira.responseCache is None:
+            f = self.Jira.http.open(path, params, idempotent=True)
+            try:
+                return parse(f)
+            finally:
+                f.close()
+        return self.Jira.cachedRequest('estimate', self.key, path, params,
+                                       parse)
 
     def getComments(self):
         """Returns an array of dictionaries"""
@@ -370,10 +2161,41 @@ class JiraIssue(JiraObject):
     # Mutator methods
 
     def update(self,valuelist):
-        """Update fields of an issue. Used internally and externally."""
-
+        """Update fields of an issue. Used internally and externally.
+        Inside a batch() block the values are held back until it ends."""
+
+        pending = self.__dict__.get('_pending')
+        if pending is not None:
+            for v in valuelist:
+                if not pending.has_key(v['id']):
+                    self._pendingOrder.append(v['id'])
+                pending[v['id']] = v
+            return
         self.jira.updateIssue(self.auth, self.key, valuelist)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """Defer the updates made in a with block, then send them in a
+        single updateIssue call holding the last value set for each changed
+        field. Nothing is sent if the block raises an exception."""
+
+        if self.__dict__.get('_pending') is not None:
+            # Nested, the outermost block sends the updates
+            yield self
+            return
+
+        self._pending = {}
+        self._pendingOrder = []
+        try:
+            yield self
+        except:
+            self._pending = None
+            raise
+        pending = self._pending
+        self._pending = None
+        if pending:
+            self.update([ pending[id] for id in self._pendingOrder ])
+
     def setSummary(self,summary):
         self.summary = summary
         self.update([{'id': 'summary','values': summary}])
@@ -399,9 +2221,11 @@ class JiraIssue(JiraObject):
 
     def addComment(self,comment):
         self.jira.addComment(self.auth, self.key, {'body': comment})
+        self.invalidateIssueXml()
 
     def addSecureComment(self,comment,commentLevel):
         self.jira.addComment(self.auth, self.key, {'body': comment, 'roleLevel': commentLevel})
+        self.invalidateIssueXml()
 
     def setCustomField(self,name,value,update=True):
         """Sets the specified custom field"""
@@ -416,22 +2240,37 @@ class JiraIssue(JiraObject):
 
         if update:
             self.update([{'id': self.customFields[name], 'values': value}])
+        else:
+            dirty = self.__dict__.setdefault('_dirtyCustomFields', [])
+            if self.customFields[name] not in dirty:
+                dirty.append(self.customFields[name])
 
     def updateCustomFields(self):
+        """Send the custom fields set with update=False"""
+
+        dirty = self.__dict__.get('_dirtyCustomFields')
+        if not dirty:
+            return
         updates = []
         for cf in self.customFieldValues:
-            updates.append({'id': cf['customfieldId'],
-                            'values': cf['values']})
+            if cf['customfieldId'] in dirty:
+                updates.append({'id': cf['customfieldId'],
+                                'values': cf['values']})
 
         self.update(updates)
+        self._dirtyCustomFields = []
 
     def addFixedVersion(self,versionName):
-        # Find the version id. Doesn't Jira provide this?
-        versions = self.jira.getVersions(self.auth, self.project)
-        id = [v.id for v in versions if v.name == versionName][0]
+        id = self.Jira.metadata.getVersionId(self.project, versionName)
 
-        fixedin = map(lambda v: v['id'], self.fixVersions) + [id]
-        self.update([{'id': 'fixVersions', 'values': fixedin }])
+        fixedin = map(lambda v: v['id'], self.fixVersions)
+        if id in fixedin:
+            return
+        version = Types.structType(name='RemoteVersion')
+        version._addItem('id', id)
+        version._addItem('name', versionName)
+        self.fixVersions = list(self.fixVersions) + [version]
+        self.update([{'id': 'fixVersions', 'values': fixedin + [id] }])
 
     def attachFile(self,path,name=None):
         """Attach file to this issue"""
@@ -446,141 +2285,154 @@ class JiraIssue(JiraObject):
         else:
             filename = os.path.basename(path)
 
-        # Read in the file
-        f = file(path,"rb")
-        data = f.read()
-        f.close()
-        data = base64.encodestring(data)
-
         # Make the call...
         self.jira.addAttachmentsToIssue(self.auth, self.key, [filename],
-                                        [[data]])
+                                        [[_encodeFile(path)]])
+
+    def attachFiles(self,paths,names=None,batchSize=64*1024*1024):
+        """Attach several files to this issue, sending as many per call as
+        fit in batchSize bytes (a larger file is sent on its own)"""
+
+        # check version of SOAPpy
+        if SOAPpy.__version__ < '0.12.0':
+            raise Exception("To use attachFiles you must have SOAPpy v0.12.0 or later due to an API change.")
+
+        if not names:
+            names = [ os.path.basename(p) for p in paths ]
+        if len(names) != len(paths):
+            raise Exception("Need one name per file")
+
+        # Group the files into batches
+        batches = []
+        batch = []
+        total = 0
+        for path, name in zip(paths, names):
+            size = os.path.getsize(path)
+            if batch and total + size > batchSize:
+                batches.append(batch)
+                batch = []
+                total = 0
+            batch.append((path, name))
+            total += size
+        if batch:
+            batches.append(batch)
+
+        for batch in batches:
+            self.jira.addAttachmentsToIssue(self.auth, self.key,
+                                            [ name for path, name in batch ],
+                                            [ [_encodeFile(path)]
+                                              for path, name in batch ])
 
     def linkIssue(self,linkTo,linkType):
         """Link this issue to another"""
 
-        postURL = "%s/secure/LinkExistingIssue.jspa" % (self.Jira.url)
         postdic = urllib.urlencode({'os_username': self.Jira.username,
                                     'os_password': self.Jira.password,
                                     'id': self.id, 'linkDesc': linkType,
                                     'linkKey': linkTo})
-        urllib2.urlopen(postURL,postdic)
+        self.Jira.http.request("/secure/LinkExistingIssue.jspa", postdic)
+        self.invalidateIssueXml()
+        self.Jira.invalidateIssueXml(linkTo)
+
+    def getIssueXml(self):
+        """Returns the JiraIssueXml view of this issue, fetching it only once"""
+
+        if self.__dict__.get('_issueXml') is None:
+            self._issueXml = self.Jira.getIssueXml(self.key)
+        return self._issueXml
+
+    def invalidateIssueXml(self):
+        """Forget the cached XML view, e.g. after the links have changed"""
+
+        self._issueXml = None
+        self.Jira.invalidateIssueXml(self.key)
 
     def getLinks(self):
         """Returns a dictionary of issue:linktype"""
 
-        postURL = ("%s/si/jira.issueviews:issue-xml/%s/?os_username=%s&"
-                  "os_password=%s" % (self.Jira.url,self.key,self.Jira.username,
-                                      self.Jira.password))
-        data = urllib2.urlopen(postURL).read()
-        dom = xml.dom.minidom.parseString(data)
-        ilts = dom.getElementsByTagName("issuelinktype")
-        if len(ilts) < 1:
-            return {}
         links = {}
-        for ilt in ilts:
-            for cn in ilt.childNodes:
-                if cn.nodeName == "outwardlinks" or \
-                   cn.nodeName == "inwardlinks":
-                    desc = cn.attributes['description'].value
-                    for cnn in cn.childNodes:
-                        if cnn.nodeName == "issuelink":
-                            for cnnn in cnn.childNodes:
-                                if cnnn.nodeName == "issuekey":
-                                    links[cnnn.childNodes[0].data] = desc
+        for linktype, desc, key, id in self.getIssueXml().links:
+            links[key] = desc
         return links
 
     def deleteLink(self, issue):
         """Deletes all links between this issue and the specified issue"""
 
-        postURL = ("%s/si/jira.issueviews:issue-xml/%s/?os_username=%s&"
-                  "os_password=%s" % (self.Jira.url,self.key,self.Jira.username,
-                                      self.Jira.password))
-        data = urllib2.urlopen(postURL).read()
-        dom = xml.dom.minidom.parseString(data)
-        key = dom.getElementsByTagName("key")[0].getAttribute("id")
-        ilts = dom.getElementsByTagName("issuelinktype")
+        view = self.getIssueXml()
         deleted = False
-        for ilt in ilts:
-            linktype = ilt.getAttribute("id")
-            for cn in ilt.childNodes:
-                if cn.nodeName == "outwardlinks" or \
-                   cn.nodeName == "inwardlinks":
-                    desc = cn.attributes['description'].value
-                    for cnn in cn.childNodes:
-                        if cnn.nodeName == "issuelink":
-                            for cnnn in cnn.childNodes:
-                                if cnnn.nodeName == "issuekey":
-                                    if cnnn.childNodes[0].data == issue:
-                                        id = cnnn.getAttribute("id")
-                                        self._deleteLink(key, id, linktype)
-                                        deleted = True
+        for linktype, desc, key, id in view.links:
+            if key == issue:
+                self._deleteLink(view.id, id, linktype)
+                deleted = True
         if not deleted:
             raise Exception("Issue not currently linked")
+        self.Jira.invalidateIssueXml(issue)
 
     def _deleteLink(self, id, destId, linkType):
         """Deletes the specified link"""
 
-        postURL = ("%s/secure/DeleteLink.jspa?id=%s&destId=%s&linkType=%s&"
-                   "confirm=true&os_username=%s&os_password=%s" % 
-                   (self.Jira.url,id,destId,linkType,self.Jira.username,
-                    self.Jira.password))
-        urllib2.urlopen(postURL)
+        path = ("/secure/DeleteLink.jspa?id=%s&destId=%s&linkType=%s&"
+                "confirm=true&os_username=%s&os_password=%s" %
+                (id,destId,linkType,urllib.quote(self.Jira.username),
+                 urllib.quote(self.Jira.password)))
+        self.Jira.http.request(path)
+        self.invalidateIssueXml()
 
     def getParent(self):
         """Return the key of the parent ticket if this is a sub-task. Returns
         None if this is not a sub-task."""
-        postURL = ("%s/si/jira.issueviews:issue-xml/%s/?os_username=%s&"
-                  "os_password=%s" % (self.Jira.url,self.key,self.Jira.username,
-                                      self.Jira.password))
-        data = urllib2.urlopen(postURL).read()
-        dom = xml.dom.minidom.parseString(data)
-        ps = dom.getElementsByTagName("parent")
+        ps = self.getIssueXml().parents
         if len(ps) == 0:
             return None
         if len(ps) > 1:
             raise Exception("Multiple 'parent' nodes found for %s" % (self.key))
-        return ps[0].childNodes[0].data
+        return ps[0]
 
     def getChildren(self):
         """Return a list of the keys of the child sub-task tickets if any. Returns
         empty list if this has no sub-tasks."""
-        postURL = ("%s/si/jira.issueviews:issue-xml/%s/?os_username=%s&"
-                  "os_password=%s" % (self.Jira.url,self.key,self.Jira.username,
-                                      self.Jira.password))
-        data = urllib2.urlopen(postURL).read()
-        dom = xml.dom.minidom.parseString(data)
-        subtasks_tags = dom.getElementsByTagName("subtasks")
-        if len(subtasks_tags) == 0:
-            return []
-        subtasks = []
-        for st in subtasks_tags:
-            for cn in st.childNodes:
-                if cn.nodeName == "subtask":
-                    subtasks.append(cn.childNodes[0].data)
-        return subtasks
-
-    def copyAttachmentsTo(self, destination):
-        """Copy attachments from the ticket to the destination dir"""
+        return list(self.getIssueXml().subtasks)
+
+    def copyAttachmentsTo(self, destination, maxWorkers=4, skipUnchanged=False):
+        """Copy attachments from the ticket to the destination dir.
+
+        Up to maxWorkers attachments are downloaded at once, each streamed to
+        a temporary file that is renamed into place once complete. Of
+        several attachments with the same filename, only the last one listed
+        is copied. With skipUnchanged, attachments whose file already exists
+        with the size JIRA reports are not downloaded again."""
         if not os.path.isdir(destination):
             raise Exception("Destination must be a directory")
 
-        # Get the attachment details
+        # Get the attachment details, keeping the last of each filename as
+        # it used to overwrite the others
         attachments = self.jira.getAttachmentsFromIssue(self.auth,self.key)
+        latest = {}
+        for a in attachments or []:
+            latest[a.filename] = a
+        attachments = [ a for a in attachments or []
+                        if latest[a.filename] is a ]
 
         # Build authentication string
-        auth = "os_username=%s&os_password=%s" % (self.Jira.username,
-                                                  self.Jira.password)
+        auth = "os_username=%s&os_password=%s" % (
+                    urllib.quote(self.Jira.username),
+                    urllib.quote(self.Jira.password))
 
         # Grab each attachment
-        for a in attachments:
-            url = "%s/secure/attachment/%s/%s?%s" % (self.Jira.url,a.id,
-                                                     urllib.quote(a.filename),
-                                                     auth)
-            data = urllib2.urlopen(url).read()
-            f = file("%s/%s" % (destination,a.filename),"w")
-            f.write(data)
-            f.close()
+        def fetch(a):
+            target = os.path.join(destination, a.filename)
+            if skipUnchanged and os.path.isfile(target) and \
+               os.path.getsize(target) == int(a.filesize):
+                return
+            path = "/secure/attachment/%s/%s?%s" % (a.id,
+                                                    urllib.quote(a.filename),
+                                                    auth)
+            self.Jira.http.download(path, target)
+
+        for result, error in _runConcurrently(fetch, attachments or [],
+                                              maxWorkers):
+            if error:
+                raise error
 
     def getReporter(self):
         return self.reporter
@@ -592,11 +2444,7 @@ class JiraIssue(JiraObject):
     def resolve(self, resolution):
         """Resolve the issue with the specified resolution"""
 
-        rid = None
-        for r in self.Jira.RESOLUTION:
-            if self.Jira.RESOLUTION[r] == resolution:
-                rid = r
-                break
+        rid = self.Jira.registry.resolutions.getId(resolution)
         if not rid:
             raise Exception("Unknown resolution %s" % (resolution))
 
@@ -624,10 +2472,369 @@ class JiraIssue(JiraObject):
                                                {'id': 'resolution', 'values': [str(rid)]},
                                                {'id': 'fixVersions', 'values': fixVersionIds}])
 
+def _intern(value):
+    if type(value) is str:
+        return intern(value)
+    return value
+
+class JiraIssueSnapshot(object):
+    """A compact, read-only copy of an issue's fields.
+
+    Unlike JiraIssue it keeps no reference to the RemoteIssue or its SOAP
+    wrappers. Ids are interned, versions and components are (id, name)
+    tuples and custom field values are (customfieldId, values) tuples.
+    It has the same accessors as JiraIssue; toIssue() gives a JiraIssue
+    for making changes."""
+
+    FIELDS = ('key', 'id', 'project', 'type', 'status', 'priority',
+              'resolution', 'summary', 'description', 'environment',
+              'assignee', 'reporter', 'created', 'updated', 'duedate',
+              'fixVersions', 'affectsVersions', 'components',
+              'customFieldValues')
+    __slots__ = ('Jira',) + FIELDS
+
+    def __init__(self, RemoteIssue, jira):
+        set = object.__setattr__
+        set(self, 'Jira', jira)
+        fields = RemoteIssue.__dict__
+        for name in ('key', 'id', 'summary', 'description', 'environment',
+                     'created', 'updated', 'duedate'):
+            set(self, name, fields.get(name))
+        for name in ('project', 'type', 'status', 'priority', 'resolution',
+                     'assignee', 'reporter'):
+            set(self, name, _intern(fields.get(name)))
+        for name in ('fixVersions', 'affectsVersions', 'components'):
+            set(self, name, tuple([ (_intern(v['id']), _intern(v['name']))
+                                    for v in fields.get(name) or [] ]))
+        set(self, 'customFieldValues',
+            tuple([ (_intern(cf['customfieldId']), tuple(cf['values'] or []))
+                    for cf in fields.get('customFieldValues') or [] ]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("JiraIssueSnapshot is read-only")
+
+    def toDict(self):
+        """Returns the fields as a dictionary of JSON-compatible values"""
+        d = {}
+        for name in self.FIELDS:
+            d[name] = getattr(self, name)
+        return d
+
+    @staticmethod
+    def fromDict(d, jira):
+        """Rebuild a snapshot from the result of toDict()"""
+        snapshot = object.__new__(JiraIssueSnapshot)
+        set = object.__setattr__
+        set(snapshot, 'Jira', jira)
+
+        def text(value):
+            # JSON gives unicode, keep plain strings where possible
+            if type(value) is unicode:
+                try:
+                    return intern(value.encode('ascii'))
+                except UnicodeError:
+                    pass
+            return value
+
+        for name in ('key', 'id'):
+            set(snapshot, name, text(d.get(name)))
+        for name in ('summary', 'description', 'environment'):
+            set(snapshot, name, d.get(name))
+        for name in ('created', 'updated', 'duedate'):
+            value = d.get(name)
+            if type(value) is list:
+                value = tuple(value)
+            set(snapshot, name, value)
+        for name in ('project', 'type', 'status', 'priority', 'resolution',
+                     'assignee', 'reporter'):
+            set(snapshot, name, text(d.get(name)))
+        for name in ('fixVersions', 'affectsVersions', 'components'):
+            set(snapshot, name, tuple([ (text(id), text(n))
+                                        for id, n in d.get(name) or [] ]))
+        set(snapshot, 'customFieldValues',
+            tuple([ (text(id), tuple(values))
+                    for id, values in d.get('customFieldValues') or [] ]))
+        return snapshot
+
+    def __cmp__(self, other):
+        return cmp(int(self.priority), int(other.priority))
+
+    def toIssue(self):
+        """Returns a lazy JiraIssue for this issue"""
+        return JiraIssue(key=self.key, lazy=True, jira=self.Jira)
+
+    # Accessor methods
+
+    def getKey(self):
+        return self.key
+
+    def getCreated(self):
+        return self.created
+
+    def getStatus(self):
+        return self.Jira.registry.statuses.name(self.status)
+
+    def getResolution(self):
+        if self.resolution == None:
+            return None
+        return self.Jira.registry.resolutions.name(self.resolution)
+
+    def getSummary(self):
+        return self.summary
+
+    def getDescription(self):
+        return self.description
+
+    def getEnvironment(self):
+        return self.environment
+
+    def getFixVersionNames(self):
+        return [ name for id, name in self.fixVersions ]
+
+    def getComponents(self):
+        return [ {'id': id, 'name': name} for id, name in self.components ]
+
+    def getAssignee(self):
+        return self.assignee
+
+    def getReporter(self):
+        return self.reporter
+
+    def getPriority(self):
+        return self.priority
+
+    def getType(self):
+        return self.Jira.registry.types.name(self.type)
+
+    def getCustomField(self,name):
+        """Returns the specified custom field"""
+
+        customFields = self.Jira.metadata.getCustomFields(self.project,
+                                                          self.type, self.key)
+        if not customFields.has_key(name):
+            return None
+        for id, values in self.customFieldValues:
+            if id == customFields[name]:
+                return list(values)
+
+    def getCustomTextField(self,name):
+        """Returns the specified custom field, assuming it is a free-form text field"""
+
+        f = self.getCustomField(name)
+        if f:
+            return f[0]
+
+    def getCodeComplete(self):
+        return self.getCustomTextField("Code Complete Date")
+
+    def getFeatureCommitted(self):
+        return self.getCustomTextField("Feature Committed")
+
+    def getSpecification(self):
+        return self.getCustomTextField("Specification")
+
+    def getTestImpact(self):
+        return self.getCustomTextField("Test Impact")
+
+    def getDocImpact(self):
+        return self.getCustomTextField("Documentation Impact")
+
+    def getReleaseNotes(self):
+        return self.getCustomTextField("Release Notes")
+
+    def getChangeLog(self):
+        clog = {}
+        clog['contents'] = self.getCustomTextField("Change Log Entry")
+        status = self.getCustomTextField("Change Log Visibility")
+        if status == None:
+            clog['status'] = "Internal"
+        else:
+            clog['status'] = status
+        clog['category'] = self.getCustomTextField("Change Log Category")
+        return clog
+
+def _timeString(t):
+    """Format a SOAP dateTime tuple (UTC) as sortable text"""
+    return "%04d-%02d-%02d %02d:%02d:%02d" % tuple(t[:6])
+
+class JiraMirror:
+    """A local SQLite copy of issues, stored as JiraIssueSnapshots.
+
+    sync() refreshes the issues matched by a JQL query that changed since
+    its previous sync. Statuses, fix versions and components are indexed
+    for findIssues(). Custom field ids are kept too, so that snapshot
+    accessors such as getChangeLog() work without the server. Issues
+    deleted on the server are not removed."""
+
+    def __init__(self, jira, path):
+        self.Jira = jira
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS issues (key TEXT PRIMARY KEY,
+                project TEXT, status TEXT, updated TEXT, data TEXT);
+            CREATE INDEX IF NOT EXISTS issues_status ON issues (status);
+            CREATE TABLE IF NOT EXISTS fixversions (key TEXT, name TEXT);
+            CREATE INDEX IF NOT EXISTS fixversions_key ON fixversions (key);
+            CREATE INDEX IF NOT EXISTS fixversions_name ON fixversions (name);
+            CREATE TABLE IF NOT EXISTS components (key TEXT, name TEXT);
+            CREATE INDEX IF NOT EXISTS components_key ON components (key);
+            CREATE INDEX IF NOT EXISTS components_name ON components (name);
+            CREATE TABLE IF NOT EXISTS customfields (project TEXT, type TEXT,
+                name TEXT, id TEXT, PRIMARY KEY (project, type, name));
+            CREATE TABLE IF NOT EXISTS syncs (query TEXT PRIMARY KEY,
+                since TEXT);
+            """)
+
+        # Seed the connection's metadata cache with the known custom fields
+        customFields = {}
+        for project, type, name, id in self.db.execute(
+                "SELECT project, type, name, id FROM customfields"):
+            customFields.setdefault((project, type), {})[name] = id
+        for (project, type), fields in customFields.items():
+            jira.metadata.setCustomFields(project, type, fields)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def store(self, snapshots):
+        """Add or replace the given JiraIssueSnapshots"""
+        with self.lock:
+            for s in snapshots:
+                self.db.execute("INSERT OR REPLACE INTO issues VALUES "
+                                "(?, ?, ?, ?, ?)",
+                                (s.key, s.project, s.status,
+                                 s.updated and _timeString(s.updated),
+                                 json.dumps(s.toDict())))
+                self.db.execute("DELETE FROM fixversions WHERE key = ?",
+                                (s.key,))
+                self.db.executemany("INSERT INTO fixversions VALUES (?, ?)",
+                                    [ (s.key, name)
+                                      for id, name in s.fixVersions ])
+                self.db.execute("DELETE FROM components WHERE key = ?",
+                                (s.key,))
+                self.db.executemany("INSERT INTO components VALUES (?, ?)",
+                                    [ (s.key, name)
+                                      for id, name in s.components ])
+            self.db.commit()
+
+    def _storeCustomFields(self, snapshots):
+        with self.lock:
+            known = set(self.db.execute(
+                            "SELECT DISTINCT project, type FROM customfields"))
+        for s in snapshots:
+            if (s.project, s.type) in known:
+                continue
+            known.add((s.project, s.type))
+            fields = self.Jira.metadata.getCustomFields(s.project, s.type,
+                                                        s.key)
+            with self.lock:
+                self.db.executemany("INSERT OR REPLACE INTO customfields "
+                                    "VALUES (?, ?, ?, ?)",
+                                    [ (s.project, s.type, name, id)
+                                      for name, id in fields.items() ])
+                self.db.commit()
+
+    def sync(self, jql, pageSize=500, overlap=3600):
+        """Fetch the issues matching jql that were updated since the last
+        sync of the same query (all of them the first time) and store them.
+        The last update time seen is kept as the next starting point, less
+        overlap seconds to allow for clock differences. The bound is sent
+        relative to the server's current time (e.g. updated >= "-90m"), so
+        the time zones of the client and server do not matter.
+        Returns the number of distinct issues stored."""
+
+        with self.lock:
+            row = self.db.execute("SELECT since FROM syncs WHERE query = ?",
+                                  (jql,)).fetchone()
+        latest = row and row[0]
+        start = None
+        if latest:
+            start = calendar.timegm(time.strptime(latest,
+                                                  "%Y-%m-%d %H:%M:%S"))
+            start -= overlap
+        keys = set()
+        limit = pageSize
+        while True:
+            query = "(%s)" % jql
+            if start is not None:
+                # Absolute JQL times would be read in the user's time zone,
+                # and relative ones are in whole minutes
+                minutes = int(math.ceil((time.time() - start) / 60.0))
+                query += ' AND updated >= "-%dm"' % max(minutes, 1)
+            query += " ORDER BY updated ASC"
+            ris = self.Jira.jira.getIssuesFromJqlSearch(self.Jira.auth, query,
+                                                        limit)
+            snapshots = self.Jira.wrapIssues(ris or [], snapshot=True)
+            self.store(snapshots)
+            self._storeCustomFields(snapshots)
+            for s in snapshots:
+                keys.add(s.key)
+                if s.updated and (latest is None or
+                                  _timeString(s.updated) > latest):
+                    latest = _timeString(s.updated)
+            if len(snapshots) < limit or not latest:
+                break
+            # Carry on from the last update seen, without the overlap
+            last = calendar.timegm(time.strptime(latest, "%Y-%m-%d %H:%M:%S"))
+            if start is not None and last - start < 60:
+                # The whole page fits in the minute the bound can resolve,
+                # widen the next one to get past it
+                limit *= 2
+            else:
+                limit = pageSize
+            start = last
+
+        if latest:
+            with self.lock:
+                self.db.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?)",
+                                (jql, latest))
+                self.db.commit()
+        return len(keys)
+
+    def getIssue(self, key):
+        """Returns the stored JiraIssueSnapshot for key, or None"""
+        with self.lock:
+            row = self.db.execute("SELECT data FROM issues WHERE key = ?",
+                                  (key,)).fetchone()
+        if row is None:
+            return None
+        return JiraIssueSnapshot.fromDict(json.loads(row[0]), self.Jira)
+
+    def findIssues(self, status=None, fixVersion=None, component=None,
+                   project=None):
+        """Returns the stored snapshots matching all the given criteria.
+        status may be a status name or id."""
+
+        query = "SELECT data FROM issues"
+        where = []
+        args = []
+        if status is not None:
+            where.append("status = ?")
+            args.append(self.Jira.registry.statuses.getId(status, status))
+        if fixVersion is not None:
+            where.append("key IN (SELECT key FROM fixversions WHERE name = ?)")
+            args.append(fixVersion)
+        if component is not None:
+            where.append("key IN (SELECT key FROM components WHERE name = ?)")
+            args.append(component)
+        if project is not None:
+            where.append("project = ?")
+            args.append(project)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY key"
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        return [ JiraIssueSnapshot.fromDict(json.loads(data), self.Jira)
+                 for (data,) in rows ]
+
 class JiraGroup(JiraObject):
 
-    def __init__(self, remoteGroup, groupName):
-        JiraObject.__init__(self)
+    def __init__(self, remoteGroup, groupName, jira=None):
+        JiraObject.__init__(self, jira)
 
         self.RemoteGroup = remoteGroup
         self.groupName = groupName
@@ -641,24 +2848,24 @@ class JiraGroup(JiraObject):
         users = self.RemoteGroup.users
         retusers = []
         for user in users:
-            retusers.append(JiraUser(user))
+            retusers.append(JiraUser(user, jira=self.Jira))
         return retusers
 
 class JiraUser(JiraObject):
 
-    def __init__(self, RemoteUser):
-        JiraObject.__init__(self)
+    def __init__(self, RemoteUser, jira=None):
+        JiraObject.__init__(self, jira)
 
         self.RemoteUser = RemoteUser
 
-        # Parse the fields in the Remoteuser
-        for k,v in RemoteUser.__dict__.items():
+        # Parse the fields in the Remoteuser, leaving out SOAPpy's own
+        for k,v in RemoteUser._asdict().items():
             self.__dict__[k] = v
 
 class JiraFilter(JiraObject):
 
-    def __init__(self, RemoteFilter):
-        JiraObject.__init__(self)
+    def __init__(self, RemoteFilter, jira=None):
+        JiraObject.__init__(self, jira)
 
         self.RemoteFilter = RemoteFilter
 
@@ -666,10 +2873,16 @@ class JiraFilter(JiraObject):
         for k,v in RemoteFilter.__dict__.items():
             self.__dict__[k] = v
 
-    def getIssues(self):
+    def getIssues(self, lazy=False, snapshot=False):
         """Return the issues seen using this filter"""
         issues = self.jira.getIssuesFromFilter(self.auth, self.id)
-        return [ JiraIssue(i) for i in issues ]
+        return self.Jira.wrapIssues(issues, lazy, snapshot)
+
+    def iterIssues(self, pageSize=100, lazy=False, snapshot=False):
+        """Yield the issues seen using this filter a page at a time, see
+        Jira.iterIssuesFromFilter"""
+        return self.Jira.iterIssuesFromFilter(self.id, pageSize, lazy,
+                                              snapshot)
 
     def getName(self):
         return self.name
@@ -677,3 +2890,176 @@ class JiraFilter(JiraObject):
     def getUrl(self):
         url = "%s/secure/IssueNavigator.jspa?mode=hide&requestId=%s" % (self.Jira.url,self.id)
         return url
+
+class JiraFuture:
+    """The pending result of a JiraAsync call"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._value = None
+        self._error = None
+
+    def _set(self, value, error):
+        with self._lock:
+            self._value = value
+            self._error = error
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            self._callback(fn)
+
+    def _callback(self, fn):
+        # Called on a JiraAsync worker, which must survive a failing callback
+        try:
+            fn(self)
+        except Exception:
+            _log.exception("JiraFuture callback %r failed", fn)
+
+    def done(self):
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        """Wait for the call to finish, returning False on timeout"""
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """Returns the call's result, raising its exception if it failed"""
+        if not self.wait(timeout):
+            raise JiraError("Timed out waiting for result")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def exception(self, timeout=None):
+        """Returns the exception the call raised, or None"""
+        if not self.wait(timeout):
+            raise JiraError("Timed out waiting for result")
+        return self._error
+
+    def addDoneCallback(self, fn):
+        """Call fn(future) once the call has finished (now if it has).
+        Exceptions it raises are logged to the "jira" logger and ignored."""
+        with self._lock:
+            if not self._done.isSet():
+                self._callbacks.append(fn)
+                return
+        self._callback(fn)
+
+class JiraAsync:
+    """Non-blocking front end to a Jira connection.
+
+    Every method returns a JiraFuture at once. The calls run on a fixed pool
+    of maxWorkers threads, which also limits how many requests are in
+    flight, so any number of calls can be outstanding without a thread
+    each. Issue arguments may be JiraIssue objects or issue keys, and
+    issues are returned as ordinary JiraIssue objects."""
+
+    def __init__(self, jira, maxWorkers=8):
+        self.Jira = jira
+        self.queue = Queue.Queue()
+        self.threads = []
+        for i in range(maxWorkers):
+            t = threading.Thread(target=self._worker)
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            future, func, args = job
+            try:
+                value = func(*args)
+            except Exception, e:
+                future._set(None, e)
+            else:
+                future._set(value, None)
+
+    def close(self, wait=True):
+        """Stop the workers once the queued calls are done"""
+        for t in self.threads:
+            self.queue.put(None)
+        if wait:
+            for t in self.threads:
+                t.join()
+
+    def submit(self, func, *args):
+        """Run func(*args) on the pool, returning a JiraFuture"""
+        future = JiraFuture()
+        self.queue.put((future, _withProfiles(_activeProfiles(), func), args))
+        return future
+
+    def _issue(self, issue):
+        if isinstance(issue, JiraIssue):
+            return issue
+        return JiraIssue(key=issue, lazy=True, jira=self.Jira)
+
+    def _call(self, issue, method, *args):
+        return self.submit(lambda: getattr(self._issue(issue), method)(*args))
+
+    # Lookups
+
+    def getIssue(self, key, lazy=False):
+        return self.submit(self.Jira.getIssue, key, lazy)
+
+    def getIssuesFromFilter(self, filterId, lazy=False, snapshot=False):
+        return self.submit(self.Jira.getIssuesFromFilter, filterId, lazy,
+                           snapshot)
+
+    def getComments(self, issue):
+        return self._call(issue, 'getComments')
+
+    def getLinks(self, issue):
+        return self._call(issue, 'getLinks')
+
+    def getParent(self, issue):
+        return self._call(issue, 'getParent')
+
+    def getChildren(self, issue):
+        return self._call(issue, 'getChildren')
+
+    def getOriginalEstimate(self, issue):
+        return self._call(issue, 'getOriginalEstimate')
+
+    # Changes
+
+    def addComment(self, issue, comment):
+        return self._call(issue, 'addComment', comment)
+
+    def linkIssue(self, issue, linkTo, linkType):
+        return self._call(issue, 'linkIssue', linkTo, linkType)
+
+    def deleteLink(self, issue, linkedIssue):
+        return self._call(issue, 'deleteLink', linkedIssue)
+
+    def copyAttachmentsTo(self, issue, destination, skipUnchanged=False):
+        # One attachment at a time per call, the pool bounds the parallelism
+        return self._call(issue, 'copyAttachmentsTo', destination, 1,
+                          skipUnchanged)
+
+    def attachFile(self, issue, path, name=None):
+        return self._call(issue, 'attachFile', path, name)
+
+    def accept(self, issue):
+        return self._call(issue, 'accept')
+
+    def resolve(self, issue, resolution):
+        return self._call(issue, 'resolve', resolution)
+
+    def progressWorkflowAction(self, issue, action, values):
+        """Run the workflow action with the given id and field values"""
+        key = isinstance(issue, JiraIssue) and issue.key or issue
+        return self.submit(self.Jira.jira.progressWorkflowAction,
+                           self.Jira.auth, key, action, values)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (C) 2006-2009 Citrix Systems Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation; version 2.1 only. with the special
+# exception on linking described in file LICENSE.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+"""JiraMirror.sync against a StubJira server, which applies the relative
+updated bound and the ordering of the JQL it is sent."""
+
+import os, sys, time, shutil, tempfile
+import unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, ".."), os.path.join(here, "..", "benchmarks")]
+import jira
+import stubjira
+
+class MirrorSyncTest(unittest.TestCase):
+
+    ISSUES = 1000
+
+    def setUp(self):
+        self.stub = stubjira.StubJira(issues=self.ISSUES, comments=0, links=0,
+                                      subtasks=0, customFields=2)
+        self.stub.start()
+        self.workdir = tempfile.mkdtemp()
+        self.jira = jira.Jira(self.stub.url, "user", "password")
+        self.mirror = self.jira.openMirror(os.path.join(self.workdir, "db"))
+
+        # Record the page sizes asked for
+        self.limits = []
+        search = self.stub.soap_getIssuesFromJqlSearch
+        def recordingSearch(auth, jql, maxResults):
+            self.limits.append(int(maxResults))
+            return search(auth, jql, maxResults)
+        self.stub.soap_getIssuesFromJqlSearch = recordingSearch
+
+    def tearDown(self):
+        self.mirror.close()
+        self.stub.stop()
+        shutil.rmtree(self.workdir)
+
+    def setUpdated(self, keys, times):
+        with self.stub.lock:
+            for key, t in zip(keys, times):
+                self.stub.issues[key]["updated"] = time.gmtime(t)
+
+    def test_first_sync_within_overlap(self):
+        # All issues updated within the last 50 minutes, less than overlap
+        now = time.time()
+        self.setUpdated(self.stub.order,
+                        [ now - 3000 + 3 * n for n in range(self.ISSUES) ])
+        self.assertEqual(self.mirror.sync("project = CA", pageSize=200),
+                         self.ISSUES)
+        self.assertEqual(max(self.limits), 200)
+        # Each page overlaps the previous one by under a minute
+        self.assertTrue(len(self.limits) <= 7, self.limits)
+        self.assertEqual(len(self.mirror.findIssues(project="CA")),
+                         self.ISSUES)
+
+    def test_next_sync_applies_overlap_once(self):
+        now = time.time()
+        self.setUpdated(self.stub.order,
+                        [ now - 3 * 86400 + 60 * n
+                          for n in range(self.ISSUES) ])
+        self.mirror.sync("project = CA", pageSize=200)
+
+        # Only the issues updated within the hour before the last one seen,
+        # one a minute, give or take the minute the bound is rounded to
+        del self.limits[:]
+        count = self.mirror.sync("project = CA", pageSize=200)
+        self.assertTrue(60 <= count <= 62, count)
+        self.assertEqual(self.limits, [200])
+
+        # A changed issue is picked up by the next sync
+        self.jira.getIssue("CA-1").setSummary("Changed")
+        self.assertTrue(self.mirror.sync("project = CA", overlap=0) >= 1)
+        self.assertEqual(self.mirror.getIssue("CA-1").summary, "Changed")
+
+    def test_burst_widens_page(self):
+        # More than a page updated in the same second
+        now = time.time()
+        self.setUpdated(self.stub.order, [ now - 600 ] * self.ISSUES)
+        self.assertEqual(self.mirror.sync("project = CA", pageSize=300),
+                         self.ISSUES)
+        self.assertEqual(self.limits, [300, 300, 600, 1200])
+
+if __name__ == "__main__":
+    unittest.main()